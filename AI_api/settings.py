@@ -12,12 +12,97 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from dotenv import load_dotenv
+from AI_api.databases import database_config
 import os
 load_dotenv()  
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_MODEL_ID = os.getenv('OPENAI_MODEL_ID')
 VLLM_URL = os.getenv('VLLM_URL')
+
+# Request deadline in seconds. Clients can lower it with the X-Request-Timeout
+# header, never raise it above REQUEST_TIMEOUT_MAX.
+REQUEST_TIMEOUT_DEFAULT = float(os.getenv('REQUEST_TIMEOUT_DEFAULT', '60'))
+REQUEST_TIMEOUT_MAX = float(os.getenv('REQUEST_TIMEOUT_MAX', '120'))
+
+# Upstream call policy: retries with jittered exponential backoff under an
+# overall deadline (seconds), and optional hedging for the listed backends.
+# Hedged duplicates run on UPSTREAM_HEDGE_WORKERS threads per process.
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '3'))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5'))
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '8'))
+UPSTREAM_DEADLINE = float(os.getenv('UPSTREAM_DEADLINE', '60'))
+UPSTREAM_RETRY_STATUSES = [int(code) for code in os.getenv('UPSTREAM_RETRY_STATUSES', '408,409,429,500,502,503,504').split(',') if code]
+UPSTREAM_HEDGE_BACKENDS = [name for name in os.getenv('UPSTREAM_HEDGE_BACKENDS', '').split(',') if name]
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', '95'))
+UPSTREAM_HEDGE_DEFAULT_DELAY = float(os.getenv('UPSTREAM_HEDGE_DEFAULT_DELAY', '5'))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv('UPSTREAM_HEDGE_MIN_SAMPLES', '20'))
+UPSTREAM_HEDGE_WORKERS = int(os.getenv('UPSTREAM_HEDGE_WORKERS', '16'))
+UPSTREAM_LATENCY_WINDOW = int(os.getenv('UPSTREAM_LATENCY_WINDOW', '200'))
+
+# Ask the models for JSON matching the evaluation schema (OpenAI response
+# format, vLLM guided decoding) and retry unparseable output server-side.
+STRUCTURED_OUTPUT = os.getenv('STRUCTURED_OUTPUT', 'true').lower() == 'true'
+STRUCTURED_OUTPUT_RETRIES = int(os.getenv('STRUCTURED_OUTPUT_RETRIES', '1'))
+
+# Weighted fair scheduling: at most UPSTREAM_SLOTS calls in flight per backend
+# and process, e.g. "openai=32,soc=16,sci=16" (unlisted backends are not
+# limited). Waiting calls are served by lane with SCHEDULER_LANE_WEIGHTS, then
+# by key with Keys.scheduling_weight.
+UPSTREAM_SLOTS = {
+    alias: int(slots)
+    for alias, slots in (item.split('=') for item in os.getenv('UPSTREAM_SLOTS', '').split(',') if item)
+}
+SCHEDULER_LANE_WEIGHTS = {
+    lane: float(weight)
+    for lane, weight in (item.split('=') for item in os.getenv('SCHEDULER_LANE_WEIGHTS', 'interactive=4,bulk=1').split(',') if item)
+}
+
+# Output length: max_tokens is the MAX_TOKENS_PERCENTILE of the last
+# MAX_TOKENS_SAMPLE completion lengths of the backend and difficulty, times
+# MAX_TOKENS_MARGIN, at least MAX_TOKENS_MIN and at most the backend's
+# MAX_TOKENS_CEILING (unlisted backends have no ceiling). The ceiling is used
+# until MAX_TOKENS_MIN_SAMPLES lengths exist, and for one retry when a
+# truncated output does not parse.
+ADAPTIVE_MAX_TOKENS = os.getenv('ADAPTIVE_MAX_TOKENS', 'true').lower() == 'true'
+MAX_TOKENS_CEILING = {
+    alias: int(limit)
+    for alias, limit in (item.split('=') for item in os.getenv('MAX_TOKENS_CEILING', 'soc=500,sci=500').split(',') if item)
+}
+MAX_TOKENS_PERCENTILE = float(os.getenv('MAX_TOKENS_PERCENTILE', '99'))
+MAX_TOKENS_MARGIN = float(os.getenv('MAX_TOKENS_MARGIN', '1.25'))
+MAX_TOKENS_MIN = int(os.getenv('MAX_TOKENS_MIN', '64'))
+MAX_TOKENS_SAMPLE = int(os.getenv('MAX_TOKENS_SAMPLE', '500'))
+MAX_TOKENS_MIN_SAMPLES = int(os.getenv('MAX_TOKENS_MIN_SAMPLES', '50'))
+MAX_TOKENS_REFRESH = float(os.getenv('MAX_TOKENS_REFRESH', '300'))
+
+# Model cascade, e.g. "openai=soc": requests on a subdomain are first sent to
+# the cheaper backend and only escalated to the subdomain's model when the
+# answer does not parse, is cut off, scores outside 0..total_marks, has an
+# explanation or feedback under CASCADE_MIN_TEXT characters, or has a mean
+# token probability under CASCADE_MIN_CONFIDENCE. TOKEN_PRICES are dollars per
+# million prompt/completion tokens, used to report the savings.
+CASCADE = {
+    alias: tier
+    for alias, tier in (item.split('=') for item in os.getenv('CASCADE', '').split(',') if item)
+}
+CASCADE_MIN_TEXT = int(os.getenv('CASCADE_MIN_TEXT', '20'))
+CASCADE_MIN_CONFIDENCE = float(os.getenv('CASCADE_MIN_CONFIDENCE', '0.7'))
+TOKEN_PRICES = {
+    alias: tuple(float(price) for price in prices.split('/'))
+    for alias, prices in (item.split('=') for item in os.getenv('TOKEN_PRICES', 'openai=0.8/3.2').split(',') if item)
+}
+
+# Share one upstream call between concurrent requests with the same backend,
+# prompt and parameters.
+COALESCE_REQUESTS = os.getenv('COALESCE_REQUESTS', 'true').lower() == 'true'
+
+# Optional near-duplicate answer cache: reuse the stored evaluation when an
+# answer to the same question is at least NEAR_DUPLICATE_THRESHOLD similar
+# (estimated Jaccard over character shingles) to a past one.
+NEAR_DUPLICATE_CACHE = os.getenv('NEAR_DUPLICATE_CACHE', 'false').lower() == 'true'
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.9'))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', '50000'))
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,6 +132,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api_proj.middleware.ProfilingMiddleware',
+    'api_proj.middleware.CaptureMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,8 +142,11 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'api_proj.middleware.LoggingMiddleware',
+    'api_proj.middleware.DeadlineMiddleware',
     'api_proj.middleware.SubdomMiddleware',
     'api_proj.middleware.APIKeyAuthMiddleware',
+    'api_proj.middleware.RateLimitMiddleware',
+    'api_proj.middleware.QuotaMiddleware',
     'api_proj.middleware.HashedMiddleware',
 ]
 
@@ -83,22 +173,85 @@ WSGI_APPLICATION = 'AI_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Each subdomain alias can point at a server database with
+# <ALIAS>_DATABASE_URL, see AI_api/databases.py.
 DATABASES = {
     'default': {},
-    'openai': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'openai.sqlite3',
-    },
-    'soc': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'soc.sqlite3',
-    },
-    'sci': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'sci.sqlite3',
-    }
+    'openai': database_config('openai', BASE_DIR / 'openai.sqlite3'),
+    'soc': database_config('soc', BASE_DIR / 'soc.sqlite3'),
+    'sci': database_config('sci', BASE_DIR / 'sci.sqlite3'),
 }
 
+DATABASE_ROUTERS = ['api_proj.routers.SubdomainRouter']
+
+# State shared by the worker processes of one host (API key cache, rate
+# limits). Point SHARED_STATE_SOCKET at the socket of `manage.py shared_state`;
+# without it every process keeps its own state.
+SHARED_STATE_SOCKET = os.getenv('SHARED_STATE_SOCKET', '')
+SHARED_STATE_MAX_ENTRIES = int(os.getenv('SHARED_STATE_MAX_ENTRIES', '100000'))
+SHARED_STATE_TIMEOUT = float(os.getenv('SHARED_STATE_TIMEOUT', '0.5'))
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', '60'))
+
+# vLLM replicas serving soc and sci: base URLs like VLLM_URL, comma separated,
+# defaulting to VLLM_URL alone. When VLLM_REPLICAS_FILE exists its lines are
+# used instead and re-read every VLLM_HEALTH_INTERVAL seconds, so replicas can
+# be changed at runtime with `manage.py vllm_replicas`. VLLM_BALANCING is
+# least_outstanding or latency; a replica is taken out after
+# VLLM_UNHEALTHY_AFTER failed calls or a failed /health probe.
+VLLM_REPLICAS = [url for url in os.getenv('VLLM_REPLICAS', VLLM_URL or '').split(',') if url]
+VLLM_REPLICAS_FILE = os.getenv('VLLM_REPLICAS_FILE', str(BASE_DIR / 'vllm_replicas.txt'))
+VLLM_BALANCING = os.getenv('VLLM_BALANCING', 'least_outstanding')
+VLLM_HEALTH_INTERVAL = float(os.getenv('VLLM_HEALTH_INTERVAL', '5'))
+VLLM_HEALTH_TIMEOUT = float(os.getenv('VLLM_HEALTH_TIMEOUT', '2'))
+VLLM_UNHEALTHY_AFTER = int(os.getenv('VLLM_UNHEALTHY_AFTER', '3'))
+VLLM_WARM_CONNECTIONS = int(os.getenv('VLLM_WARM_CONNECTIONS', '4'))
+
+# Per-request profiling: a PROFILE_SAMPLE_RATE fraction of requests, and
+# requests with an X-Profile header equal to PROFILE_TOKEN, are traced with
+# cProfile into PROFILE_DIR, keeping the newest PROFILE_MAX_FILES. Both off
+# by default, which removes the middleware. Sampling requires PROFILE_TOKEN,
+# which /profiles/ needs to list and fetch the traces.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+
+# Traffic capture for replay.py: a CAPTURE_SAMPLE_RATE fraction of requests to
+# CAPTURE_PATHS is written to JSONL files in CAPTURE_DIR, rotated every
+# CAPTURE_FILE_BYTES, keeping CAPTURE_MAX_FILES. Off by default.
+CAPTURE_SAMPLE_RATE = float(os.getenv('CAPTURE_SAMPLE_RATE', '0'))
+CAPTURE_PATHS = [path for path in os.getenv('CAPTURE_PATHS', '/ai/generate/,/ai/info/,/history/').split(',') if path]
+CAPTURE_DIR = os.getenv('CAPTURE_DIR', str(BASE_DIR / 'captures'))
+CAPTURE_FILE_BYTES = int(os.getenv('CAPTURE_FILE_BYTES', str(50 * 1024 * 1024)))
+CAPTURE_MAX_FILES = int(os.getenv('CAPTURE_MAX_FILES', '20'))
+
+# Per-minute generation limits per key and subdomain, e.g. "openai=10,soc=15,sci=15".
+RATE_LIMITS = {
+    alias: int(limit)
+    for alias, limit in (item.split('=') for item in os.getenv('RATE_LIMITS', '').split(',') if item)
+}
+
+# Usage accounting: counters are kept in memory and flushed to the database
+# every USAGE_FLUSH_INTERVAL seconds or after USAGE_FLUSH_SIZE requests.
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '10'))
+USAGE_FLUSH_SIZE = int(os.getenv('USAGE_FLUSH_SIZE', '500'))
+USAGE_QUOTA_CACHE_TTL = float(os.getenv('USAGE_QUOTA_CACHE_TTL', '5'))
+USAGE_SOFT_QUOTA_RATIO = float(os.getenv('USAGE_SOFT_QUOTA_RATIO', '0.8'))
+
+# History retention: rows older than HISTORY_RETENTION_DAYS are moved to
+# gzip JSONL segments under HISTORY_ARCHIVE_DIR by `manage.py archive_history`.
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '90'))
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', BASE_DIR / 'archive')
+
+# Compression of History.input/output: 'none', 'zlib' or 'zstd' (needs the
+# zstandard package). HISTORY_COMPRESSION_DICT is the hex id of a shared
+# dictionary built with `manage.py train_compression_dict`.
+HISTORY_COMPRESSION = os.getenv('HISTORY_COMPRESSION', 'none')
+HISTORY_COMPRESSION_LEVEL = int(os.getenv('HISTORY_COMPRESSION_LEVEL', '6'))
+HISTORY_COMPRESSION_MIN_SIZE = int(os.getenv('HISTORY_COMPRESSION_MIN_SIZE', '64'))
+HISTORY_COMPRESSION_DICT = os.getenv('HISTORY_COMPRESSION_DICT', '')
+HISTORY_COMPRESSION_DICT_DIR = os.getenv('HISTORY_COMPRESSION_DICT_DIR', BASE_DIR / 'compression')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,38 @@
+"""
+API-only settings profile: DJANGO_SETTINGS_MODULE=AI_api.settings_api
+
+The API subdomains authenticate with X-API-KEY and answer in JSON, so the
+admin, sessions, messages, CSRF and auth stacks are left out of the apps
+and middleware. Serve the admin from a separate process that uses the
+full AI_api.settings.
+"""
+from AI_api.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'api_proj.apps.ApiProjConfig',
+]
+
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if middleware not in (
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    )
+]
+
+# Nothing is rendered from templates without the browsable API
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# DRF would otherwise load django.contrib.auth for session/basic auth and
+# AnonymousUser; API keys are checked by APIKeyAuthMiddleware instead.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'UNAUTHENTICATED_USER': None,
+}
@@ -1,6 +1,30 @@
-from django.contrib import admin
-from api_proj.models import Keys, History
+from django.contrib import admin, messages
+from django.db.models.expressions import RawSQL
+from api_proj import search
+from api_proj.models import Keys, History, UsageCounter
+
+
+class HistoryAdmin(admin.ModelAdmin):
+    list_display = ("id", "key", "timestamp", "score")
+    list_filter = ("key",)
+    # Searched through the full-text index, see get_search_results
+    search_fields = ("input", "output")
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        if not search.available(queryset.db):
+            # The text columns are compressed BLOBs, icontains cannot search them
+            self.message_user(request, "Full-text search needs an SQLite database.", messages.WARNING)
+            return queryset.none(), False
+        query = search.match_query(search_term)
+        if query is None:
+            return queryset, False
+        sql, params = search.matching_ids(query)
+        return queryset.filter(id__in=RawSQL(sql, params)), False
+
 
 # Register your models here.
 admin.site.register(Keys)
-admin.site.register(History)
\ No newline at end of file
+admin.site.register(History, HistoryAdmin)
+admin.site.register(UsageCounter)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ApiProjConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api_proj'
+
+    def ready(self):
+        from api_proj import signals  # noqa: F401
@@ -0,0 +1,176 @@
+import gzip
+import json
+import os
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from . import search
+from .models import History
+import logging
+logger = logging.getLogger(__name__)
+
+# Columns written to archive segments, in order.
+FIELDS = ["id", "key_id", "timestamp", "input", "output", "prompt_tokens", "completion_tokens", "cached_tokens",
+          "score", "explanation", "feedback", "difficulty", "truncated", "backend"]
+INDEX_FILE = "index.jsonl"
+
+
+def archive_dir(subdomain):
+    return Path(settings.HISTORY_ARCHIVE_DIR) / subdomain
+
+
+def read_index(subdomain):
+    """Segment entries of a subdomain's archive, oldest first."""
+    path = archive_dir(subdomain) / INDEX_FILE
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _serialize(row):
+    row = dict(row)
+    row["timestamp"] = row["timestamp"].isoformat()
+    return json.dumps(row, ensure_ascii=False)
+
+
+def write_segment(subdomain, rows):
+    """
+    Write rows to a new gzip JSONL segment and append it to the index.
+    The segment is renamed into place only once it is fully written, so a
+    crash never leaves a partial segment behind.
+    """
+    directory = archive_dir(subdomain)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"segment-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.jsonl.gz"
+    tmp_path = directory / f".{name}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(_serialize(row) + "\n")
+    os.replace(tmp_path, directory / name)
+
+    entry = {
+        "file": name,
+        "rows": len(rows),
+        "min_id": rows[0]["id"],
+        "max_id": rows[-1]["id"],
+        "min_timestamp": min(row["timestamp"] for row in rows).isoformat(),
+        "max_timestamp": max(row["timestamp"] for row in rows).isoformat(),
+        "keys": sorted({row["key_id"] for row in rows}),
+        # Rows per key, so history pages can skip segments without opening them
+        "key_rows": dict(Counter(str(row["key_id"]) for row in rows)),
+    }
+    with open(directory / INDEX_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return entry
+
+
+def archive_history(subdomain, cutoff, batch_size=5000):
+    """
+    Move History rows older than cutoff from the subdomain database into
+    archive segments, one segment per batch. Rows are deleted only after
+    their segment is on disk. Returns the number of rows archived.
+    """
+    archived = 0
+    while True:
+        rows = list(History.objects.using(subdomain)
+                    .filter(timestamp__lt=cutoff)
+                    .order_by("id")
+                    .values(*FIELDS)[:batch_size])
+        if not rows:
+            return archived
+        entry = write_segment(subdomain, rows)
+        with transaction.atomic(using=subdomain):
+            if search.available(subdomain):
+                search.remove(subdomain, [(row["id"], row["input"], row["output"]) for row in rows])
+            History.objects.using(subdomain).filter(
+                id__gte=rows[0]["id"],
+                id__lte=rows[-1]["id"],
+                timestamp__lt=cutoff,
+            ).delete()
+        archived += len(rows)
+        logger.info(f"Archived {len(rows)} {subdomain} history rows to {entry['file']}")
+
+
+def key_segments(subdomain, key_id):
+    """
+    Index entries of the segments holding rows of one key, in id order. A
+    segment written again after a crash has the same file name and is
+    listed once.
+    """
+    entries = {}
+    for entry in read_index(subdomain):
+        if key_id in entry["keys"]:
+            entries[entry["file"]] = entry
+    return sorted(entries.values(), key=lambda entry: entry["min_id"])
+
+
+def read_segment(subdomain, entry, key_id):
+    """Rows of one key in a segment, in id order."""
+    path = archive_dir(subdomain) / entry["file"]
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [row for row in map(json.loads, f) if row["key_id"] == key_id]
+
+
+def read_archived(subdomain, key_id):
+    """
+    Archived History rows of one key, oldest first. Only segments whose
+    index entry lists the key are opened.
+    """
+    rows = {}
+    for entry in key_segments(subdomain, key_id):
+        for row in read_segment(subdomain, entry, key_id):
+            # Re-running after a crash may archive a row twice, keep one copy
+            rows[row["id"]] = row
+    return [rows[row_id] for row_id in sorted(rows)]
+
+
+def _segment_groups(entries):
+    """
+    Split a key's segments, in min_id order, into groups whose id ranges
+    overlap. Rows can only be archived twice within a group.
+    """
+    groups = []
+    max_id = None
+    for entry in entries:
+        if groups and entry["min_id"] <= max_id:
+            groups[-1].append(entry)
+            max_id = max(max_id, entry["max_id"])
+        else:
+            groups.append([entry])
+            max_id = entry["max_id"]
+    return groups
+
+
+def read_archived_page(subdomain, key_id, offset, limit):
+    """
+    One page of a key's archived rows, oldest first, and the key's total
+    number of archived rows. Segments before or after the page are counted
+    from the index without being opened. Segments that overlap another
+    one, after a re-archive, and segments written before the index kept
+    per-key counts are read, so rows archived twice are counted once.
+    """
+    rows = []
+    total = 0
+    skip = offset
+    for group in _segment_groups(key_segments(subdomain, key_id)):
+        count = group[0].get("key_rows", {}).get(str(key_id)) if len(group) == 1 else None
+        if count is not None and (len(rows) >= limit or count <= skip):
+            total += count
+            if len(rows) < limit:
+                skip -= count
+            continue
+        group_rows = {}
+        for entry in group:
+            for row in read_segment(subdomain, entry, key_id):
+                group_rows[row["id"]] = row
+        group_rows = [group_rows[row_id] for row_id in sorted(group_rows)]
+        total += len(group_rows)
+        if len(rows) < limit:
+            page = group_rows[skip:skip + limit - len(rows)]
+            skip = max(0, skip - len(group_rows))
+            rows.extend(page)
+    return rows, total
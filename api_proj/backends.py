@@ -0,0 +1,295 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from django.conf import settings
+from . import coalesce, evaluation, metrics, output_length, replicas, scheduler, upstream
+from .deadline import remaining
+import logging
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are an expert answer evaluator. Your job is to evaluate student answers fairly based on a flexible rubric and the specified difficulty level.\n\nInstructions:\n1. Return the score out of the total marks.\n2. Give a brief explanation justifying the score, referencing key points from the rubric.\n3. Suggest at least one specific way the student can improve their answer quality or overall academic performance.\n4. Use the rubric as a guideline, not a rigid checklist.\n5. Adjust the strictness of grading based on difficulty:\n   - 'easy' → lenient evaluation; minor issues can be overlooked.\n   - 'medium' → balanced and reasonable evaluation.\n   - 'hard' → stricter evaluation; all points must be well explained and accurate."
+
+messages = [
+    {"role": "system", "content": SYSTEM_PROMPT},
+]
+
+alpaca_prompt = """Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
+
+            ### Instruction:
+            {}
+
+            ### Input:
+            {}
+
+            ### Response:
+            {}"""
+
+# Prompt fields ordered from most to least shared across requests. A class
+# grading the same question only differs in the answer, so it goes last.
+PROMPT_FIELD_ORDER = ["difficulty", "total_marks", "question", "rubrics"]
+PROMPT_LAST_FIELD = "answer"
+
+# Sent with OpenAI requests so they are routed to the cache that already holds
+# the shared system prompt.
+PROMPT_CACHE_KEY = "answer-evaluator"
+
+VLLM_MODELS = {
+    "soc": "soc",
+    "sci": "sci",
+}
+
+# Stop sequences per backend. The vLLM models sometimes carry on past the
+# evaluation into a new section of the alpaca template. The end of the JSON
+# object is already enforced by guided decoding and the strict response
+# format, and a "}" stop would cut explanations that contain braces.
+STOP_SEQUENCES = {
+    "soc": ["\n###"],
+    "sci": ["\n###"],
+}
+
+
+class Completion:
+    """
+    Text and token usage returned by an upstream model call, with the
+    parsed evaluation (None when the text is not a valid evaluation).
+    truncated is true when the model stopped at max_tokens. confidence is
+    the mean token probability when logprobs were requested, and backend
+    the subdomain whose model wrote the text.
+    """
+    def __init__(self, text, prompt_tokens=None, completion_tokens=None, cached_tokens=None,
+                 finish_reason=None, confidence=None, backend=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+        self.truncated = finish_reason == "length"
+        self.confidence = confidence
+        self.backend = backend
+        self.evaluation = evaluation.parse(text)
+
+
+def shape_prompt(prompt):
+    """
+    Re-serialize a JSON evaluation prompt with a canonical field order and
+    fixed separators, so requests share the longest possible byte prefix.
+    Prompts that are not a JSON object are passed through unchanged.
+    """
+    try:
+        data = json.loads(prompt)
+    except (TypeError, ValueError):
+        return prompt
+    if not isinstance(data, dict):
+        return prompt
+
+    ordered = {}
+    for field in PROMPT_FIELD_ORDER:
+        if field in data:
+            ordered[field] = data[field]
+    for field in sorted(data):
+        if field not in ordered and field != PROMPT_LAST_FIELD:
+            ordered[field] = data[field]
+    if PROMPT_LAST_FIELD in data:
+        ordered[PROMPT_LAST_FIELD] = data[PROMPT_LAST_FIELD]
+    return json.dumps(ordered, ensure_ascii=False, separators=(", ", ": "))
+
+
+def build_chat_messages(prompt):
+    """Chat messages for the OpenAI backend: fixed system prompt, then the shaped user prompt."""
+    conversation_messages = messages.copy()
+    conversation_messages.append({"role": "user", "content": shape_prompt(prompt)})
+    return conversation_messages
+
+
+def build_completion_prompt(prompt):
+    """Alpaca-formatted prompt for the vLLM backends."""
+    return alpaca_prompt.format(
+        messages[0]['content'],
+        shape_prompt(prompt),
+        ""
+    )
+
+
+def usage_counts(usage):
+    """
+    Extract (prompt_tokens, completion_tokens, cached_tokens) from a usage
+    object. vLLM only reports cached tokens when started with
+    --enable-prompt-tokens-details, so any of these can be None.
+    """
+    if usage is None:
+        return None, None, None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) if details is not None else None
+    return usage.prompt_tokens, usage.completion_tokens, cached_tokens
+
+
+def mean_confidence(logprobs):
+    """
+    exp of the mean token log-probability of a completions response, None
+    when it has no logprobs.
+    """
+    values = [value for value in (getattr(logprobs, "token_logprobs", None) or []) if value is not None]
+    if not values:
+        return None
+    return math.exp(sum(values) / len(values))
+
+
+def request_params(subdomain, prompt):
+    """
+    Keyword arguments for the SDK call that serves the given subdomain.
+    Raises ValueError for an unknown subdomain.
+    """
+    if subdomain == "openai":
+        params = {
+            "model": f"{settings.OPENAI_MODEL_ID}",
+            "messages": build_chat_messages(prompt),
+            "prompt_cache_key": PROMPT_CACHE_KEY,
+        }
+        if settings.STRUCTURED_OUTPUT:
+            params["response_format"] = evaluation.RESPONSE_FORMAT
+        return params
+    elif subdomain in VLLM_MODELS:
+        params = {
+            "model": VLLM_MODELS[subdomain],
+            "prompt": build_completion_prompt(prompt),
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "stop": STOP_SEQUENCES[subdomain],
+        }
+        if settings.STRUCTURED_OUTPUT:
+            # vLLM guided decoding, not part of the OpenAI API
+            params["extra_body"] = {"guided_json": evaluation.SCHEMA}
+        return params
+    raise ValueError("Invalid subdomain")
+
+
+def with_max_tokens(subdomain, params, max_tokens):
+    """Copy of params with the output limited to max_tokens, None for no limit."""
+    name = "max_completion_tokens" if subdomain == "openai" else "max_tokens"
+    params = {param: value for param, value in params.items() if param != name}
+    if max_tokens is not None:
+        params[name] = max_tokens
+    return params
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(subdomain):
+    """
+    The OpenAI SDK client of a backend, created on first use and shared by
+    all threads so connections are reused. The SDK takes about half a
+    second to import, so it is only imported here. The vLLM backends use
+    the clients of their replicas, see replicas.py.
+    """
+    with _clients_lock:
+        if subdomain not in _clients:
+            from openai import OpenAI
+            # Retries are handled by the upstream policy, not the SDK
+            _clients[subdomain] = OpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+        return _clients[subdomain]
+
+
+def call_model(subdomain, params, deadline=None):
+    """Run one upstream call under the call policy and wrap the result in a Completion."""
+    if subdomain == "openai":
+        client = get_client(subdomain)
+        response = upstream.call(subdomain, lambda timeout: client.chat.completions.create(
+            **params,
+            timeout=timeout,
+        ), deadline)
+        text = response.choices[0].message.content
+    else:
+        pool = replicas.get_pool()
+
+        # Each attempt, retry or hedge picks a replica again
+        def attempt(timeout):
+            attempt_deadline = time.monotonic() + timeout
+            with pool.acquire() as replica:
+                # Creating a replica's client can import the SDK, which
+                # comes out of this attempt's time
+                client = replica.client
+                left = remaining(attempt_deadline)
+                if left <= 0:
+                    import openai
+                    raise openai.APITimeoutError(request=None)
+                return client.completions.create(
+                    **params,
+                    timeout=left,
+                )
+
+        response = upstream.call(subdomain, attempt, deadline)
+        text = response.choices[0].text
+
+    finish_reason = response.choices[0].finish_reason
+    if finish_reason == "length":
+        metrics.incr(f"truncated.{subdomain}")
+    confidence = mean_confidence(getattr(response.choices[0], "logprobs", None))
+    prompt_tokens, completion_tokens, cached_tokens = usage_counts(response.usage)
+    return Completion(text, prompt_tokens, completion_tokens, cached_tokens, finish_reason, confidence, subdomain)
+
+
+def call_validated(subdomain, params, deadline=None, retries=None):
+    """
+    call_model, repeated up to retries (default STRUCTURED_OUTPUT_RETRIES)
+    times while the output does not parse as an evaluation, so clients
+    don't have to retry.
+    An unparseable output cut off by an adaptive max_tokens is first
+    retried once at the backend's ceiling.
+    """
+    completion = call_model(subdomain, params, deadline)
+    ceiling = output_length.ceiling(subdomain)
+    if completion.truncated and completion.evaluation is None and params != with_max_tokens(subdomain, params, ceiling):
+        logger.warning(f"Truncated {subdomain} evaluation, retrying without the adaptive limit")
+        metrics.incr(f"truncated.{subdomain}.retries")
+        params = with_max_tokens(subdomain, params, ceiling)
+        completion = call_model(subdomain, params, deadline)
+    if retries is None:
+        retries = settings.STRUCTURED_OUTPUT_RETRIES
+    for _ in range(retries):
+        if completion.evaluation is not None:
+            break
+        logger.warning(f"Unparseable {subdomain} evaluation, retrying")
+        metrics.incr("structured_output.retries")
+        completion = call_model(subdomain, params, deadline)
+    if completion.evaluation is None:
+        metrics.incr("structured_output.failures")
+    return completion
+
+
+def generate(subdomain, prompt, deadline=None, key=None, lane=scheduler.INTERACTIVE, retries=None, logprobs=False):
+    """
+    Send the evaluation prompt to the model behind the given subdomain.
+    Returns a Completion, raises ValueError for an unknown subdomain and
+    upstream.UpstreamError when the call policy gives up. deadline is the
+    request's monotonic deadline; running past it raises DeadlineExceeded.
+
+    The call waits for an upstream slot of the backend, shared fairly
+    between keys and lanes (see scheduler.py); key is the Keys row the call
+    is made for. Identical concurrent requests share one upstream call, and
+    one slot, when COALESCE_REQUESTS is on.
+
+    retries overrides STRUCTURED_OUTPUT_RETRIES. logprobs asks the vLLM
+    backends for token log-probabilities, for Completion.confidence.
+    """
+    params = request_params(subdomain, prompt)
+    level = output_length.difficulty(prompt)
+    params = with_max_tokens(subdomain, params, output_length.max_tokens(subdomain, level))
+    if logprobs and subdomain in VLLM_MODELS:
+        params["logprobs"] = 1
+    # Key ids are per database, and a cascade tier serves keys of another
+    # subdomain, so flows are told apart by the key's database as well
+    flow = (key._state.db, key.id) if key is not None else None
+    weight = key.scheduling_weight if key is not None else 1
+
+    def call():
+        with scheduler.slot(subdomain, flow, weight, lane, deadline):
+            return call_validated(subdomain, params, deadline, retries)
+
+    if not settings.COALESCE_REQUESTS:
+        return call()
+
+    coalesce_key = hashlib.sha256(json.dumps([subdomain, params], sort_keys=True).encode('utf-8')).hexdigest()
+    return coalesce.group.do(coalesce_key, call, deadline)
@@ -0,0 +1,180 @@
+"""
+Streaming bulk grading. Rows are read one at a time from a CSV or JSON
+Lines file, sent with bounded concurrency and appended to the output as
+they complete, so memory does not grow with the file. Rerunning with the
+same output file skips the rows that already have a score.
+
+Used by `manage.py grade_file` and the Streamlit upload tab, so it does
+not import Django.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+FIELDS = ["question", "answer", "rubrics", "total_marks", "difficulty"]
+REQUIRED_FIELDS = ["question", "answer", "rubrics"]
+RESULT_FIELDS = ["row", "id", "score", "explanation", "feedback", "error"]
+
+
+def file_format(path):
+    """'csv' or 'jsonl', from the file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Unsupported file type {extension!r}, use .csv or .jsonl")
+
+
+def read_rows(handle, fmt):
+    """
+    Yield (row number, record) from a text file handle, starting at 1.
+    Lines that are not JSON objects yield None as the record.
+    """
+    if fmt == "csv":
+        yield from enumerate(csv.DictReader(handle), 1)
+        return
+    for number, line in enumerate(handle, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def build_prompt(record):
+    """The prompt the API expects for a row, ValueError if fields are missing."""
+    if record is None:
+        raise ValueError("Row is not a JSON object")
+    missing = [field for field in REQUIRED_FIELDS if not str(record.get(field) or "").strip()]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}")
+    prompt = {field: record[field] for field in FIELDS if record.get(field) not in (None, "")}
+    if isinstance(prompt.get("total_marks"), str) and prompt["total_marks"].strip().isdigit():
+        prompt["total_marks"] = int(prompt["total_marks"])
+    return json.dumps(prompt)
+
+
+def completed_rows(path):
+    """Row numbers in an existing output file that were graded without error."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, newline="", encoding="utf-8") as handle:
+        if file_format(path) == "csv":
+            results = csv.DictReader(handle)
+        else:
+            results = (json.loads(line) for line in handle if line.strip())
+        for result in results:
+            if not result.get("error"):
+                done.add(int(result["row"]))
+    return done
+
+
+class ResultWriter:
+    """Appends results to a CSV or JSON Lines file, flushing every flush_every results."""
+    def __init__(self, path, flush_every=100):
+        self.fmt = file_format(path)
+        self.flush_every = flush_every
+        self.pending = 0
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.handle = open(path, "a", newline="", encoding="utf-8")
+        if self.fmt == "csv":
+            self.csv = csv.DictWriter(self.handle, fieldnames=RESULT_FIELDS)
+            if new:
+                self.csv.writeheader()
+
+    def write(self, result):
+        if self.fmt == "csv":
+            self.csv.writerow(result)
+        else:
+            self.handle.write(json.dumps(result) + "\n")
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.handle.flush()
+        self.pending = 0
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def result_row(row, record, evaluation=None, error=None):
+    evaluation = evaluation or {}
+    return {
+        "row": row,
+        "id": (record or {}).get("id", ""),
+        "score": evaluation.get("Score", ""),
+        "explanation": evaluation.get("Explanation", ""),
+        "feedback": evaluation.get("Feedback", ""),
+        "error": error or "",
+    }
+
+
+def run(rows, submit, writer, concurrency=8, done=frozenset(), stop=None, on_result=None):
+    """
+    Grade rows with at most concurrency calls of submit(prompt) in flight.
+    submit returns the parsed evaluation or raises. Rows in done are
+    skipped; stop() is checked before each row is sent and ends the run
+    early when true. on_result(result) is called in the caller's thread.
+    Returns counts of graded, failed and skipped rows.
+    """
+    counts = {"graded": 0, "failed": 0, "skipped": 0}
+    pending = {}
+
+    def record(row, record, evaluation=None, error=None):
+        if error is None and evaluation is None:
+            error = "Model output could not be parsed"
+        result = result_row(row, record, evaluation, error)
+        writer.write(result)
+        counts["failed" if error else "graded"] += 1
+        if on_result is not None:
+            on_result(result)
+
+    def collect(futures):
+        for future in futures:
+            row, item = pending.pop(future)
+            try:
+                record(row, item, evaluation=future.result())
+            except Exception as e:
+                record(row, item, error=str(e) or type(e).__name__)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for row, item in rows:
+            if row in done:
+                counts["skipped"] += 1
+                continue
+            if stop is not None and stop():
+                break
+            try:
+                prompt = build_prompt(item)
+            except ValueError as e:
+                record(row, item, error=str(e))
+                continue
+            # Only a bounded window of rows is held in memory
+            while len(pending) >= concurrency:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending[executor.submit(submit, prompt)] = (row, item)
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    finally:
+        # When interrupted, let calls already sent finish and keep their
+        # results so they are not graded twice on resume
+        executor.shutdown(wait=True, cancel_futures=True)
+        collect([future for future in list(pending) if not future.cancelled()])
+        writer.flush()
+    return counts
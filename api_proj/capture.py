@@ -0,0 +1,83 @@
+"""
+Traffic capture for replay.py. CaptureMiddleware records a
+CAPTURE_SAMPLE_RATE fraction of the requests to CAPTURE_PATHS as JSON
+lines: arrival time, method, path, headers without credentials, body and
+the status and duration the server answered with. Each worker process
+writes its own capture-<time>-<pid>-<n>.jsonl in CAPTURE_DIR, starting a new
+file after CAPTURE_FILE_BYTES and keeping the newest CAPTURE_MAX_FILES.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from django.conf import settings
+
+# Never written to capture files. The API key is kept as a fingerprint so
+# replays can tell keys apart.
+SECRET_HEADERS = {"x-api-key", "authorization", "proxy-authorization", "cookie", "x-profile"}
+
+
+def enabled():
+    return settings.CAPTURE_SAMPLE_RATE > 0
+
+
+def sampled(request):
+    return (request.path in settings.CAPTURE_PATHS
+            and random.random() < settings.CAPTURE_SAMPLE_RATE)
+
+
+def key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else None
+
+
+def record(request, body, started, response, duration):
+    """The capture line of a request and its response."""
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in SECRET_HEADERS}
+    return {
+        "ts": started,
+        "method": request.method,
+        "path": request.path,
+        "query": request.META.get("QUERY_STRING", ""),
+        "headers": headers,
+        "key": key_fingerprint(request.headers.get("X-API-KEY", "")),
+        "body": body.decode("utf-8", errors="replace"),
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 1),
+    }
+
+
+class CaptureWriter:
+    """Appends capture lines to this process's current file, rotating by size."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handle = None
+        # Numbers this process's files, several can start within a second
+        self.sequence = 0
+
+    def write(self, line):
+        with self.lock:
+            if self.handle is None or self.handle.tell() >= settings.CAPTURE_FILE_BYTES:
+                self.rotate()
+            self.handle.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self.handle.flush()
+
+    def rotate(self):
+        if self.handle is not None:
+            self.handle.close()
+        os.makedirs(settings.CAPTURE_DIR, exist_ok=True)
+        self.sequence += 1
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.sequence:04d}.jsonl"
+        self.handle = open(os.path.join(settings.CAPTURE_DIR, name), "a", encoding="utf-8")
+        files = sorted(
+            (entry for entry in os.scandir(settings.CAPTURE_DIR)
+             if entry.name.startswith("capture-") and entry.name.endswith(".jsonl")),
+            key=lambda entry: (entry.stat().st_mtime, entry.name),
+        )
+        for entry in files[:-settings.CAPTURE_MAX_FILES]:
+            if entry.path != self.handle.name:
+                os.remove(entry.path)
+
+
+writer = CaptureWriter()
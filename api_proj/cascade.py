@@ -0,0 +1,118 @@
+"""
+Model cascade: answer a subdomain's requests with a cheaper backend first
+and escalate to the subdomain's own model only when that answer fails
+validation. CASCADE maps a subdomain to its first tier, e.g. openai=soc
+sends requests on the OpenAI subdomain to the local soc model first.
+"""
+import json
+import time
+from django.conf import settings
+from . import backends, metrics, scheduler, usage
+from .upstream import UpstreamError
+import logging
+logger = logging.getLogger(__name__)
+
+REJECT_REASONS = ("error", "format", "truncated", "score_range", "too_short", "low_confidence")
+
+
+def total_marks(prompt):
+    """total_marks of a JSON evaluation prompt as a number, None if absent."""
+    try:
+        data = json.loads(prompt)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    try:
+        return float(data.get("total_marks"))
+    except (TypeError, ValueError):
+        return None
+
+
+def validate(completion, prompt):
+    """None when a first-tier answer can be returned, otherwise why not."""
+    result = completion.evaluation
+    if result is None:
+        return "format"
+    if completion.truncated:
+        return "truncated"
+    marks = total_marks(prompt)
+    if result["Score"] < 0 or (marks is not None and result["Score"] > marks):
+        return "score_range"
+    if min(len(result["Explanation"].strip()), len(result["Feedback"].strip())) < settings.CASCADE_MIN_TEXT:
+        return "too_short"
+    if completion.confidence is not None and completion.confidence < settings.CASCADE_MIN_CONFIDENCE:
+        return "low_confidence"
+    return None
+
+
+def cost(backend, completion):
+    """Estimated price of a completion's tokens on a backend, in dollars."""
+    prompt_price, completion_price = settings.TOKEN_PRICES.get(backend, (0, 0))
+    return ((completion.prompt_tokens or 0) * prompt_price
+            + (completion.completion_tokens or 0) * completion_price) / 1_000_000
+
+
+def generate(subdomain, prompt, deadline=None, key=None, lane=scheduler.INTERACTIVE):
+    """
+    backends.generate through the subdomain's cascade, if it has one.
+    The first tier gets one attempt; its answer is returned when it passes
+    validate(), otherwise the subdomain's model is called. The tokens of a
+    rejected first-tier answer are recorded for the key here, the caller
+    records the returned completion.
+    """
+    kwargs = {"deadline": deadline, "key": key, "lane": lane}
+    tier = settings.CASCADE.get(subdomain)
+    if tier is None:
+        return backends.generate(subdomain, prompt, **kwargs)
+
+    import openai
+    started = time.monotonic()
+    try:
+        completion = backends.generate(tier, prompt, retries=0, logprobs=True, **kwargs)
+        reason = validate(completion, prompt)
+    except (UpstreamError, openai.APIError) as e:
+        # Any upstream failure escalates, DeadlineExceeded does not since
+        # the escalation would run out of time as well
+        logger.warning(f"Cascade tier {tier} failed for {subdomain}: {e}")
+        completion, reason = None, "error"
+    metrics.incr(f"cascade.{subdomain}.tier_attempts")
+    metrics.incr(f"cascade.{subdomain}.tier_ms", (time.monotonic() - started) * 1000)
+
+    if reason is None:
+        metrics.incr(f"cascade.{subdomain}.tier_served")
+        # What the escalation would have cost, estimated from the tier's token counts
+        metrics.incr(f"cascade.{subdomain}.saved_usd", cost(subdomain, completion) - cost(tier, completion))
+        return completion
+
+    metrics.incr(f"cascade.{subdomain}.rejected.{reason}")
+    if completion is not None:
+        metrics.incr(f"cascade.{subdomain}.saved_usd", -cost(tier, completion))
+        if key is not None:
+            usage.record(subdomain, key.id, completion, requests=0)
+    metrics.incr(f"cascade.{subdomain}.escalated")
+    try:
+        return backends.generate(subdomain, prompt, **kwargs)
+    finally:
+        metrics.incr(f"cascade.{subdomain}.escalated_ms", (time.monotonic() - started) * 1000)
+
+
+def report(counters):
+    """Per-subdomain tier hit rates, latency and estimated savings from a metrics snapshot."""
+    result = {}
+    for subdomain, tier in settings.CASCADE.items():
+        prefix = f"cascade.{subdomain}"
+        attempts = counters.get(f"{prefix}.tier_attempts", 0)
+        escalated = counters.get(f"{prefix}.escalated", 0)
+        result[subdomain] = {
+            "first_tier": tier,
+            "requests": attempts,
+            "first_tier_hit_rate": metrics.ratio(counters.get(f"{prefix}.tier_served", 0), attempts),
+            "escalation_rate": metrics.ratio(escalated, attempts),
+            "first_tier_avg_ms": round(counters.get(f"{prefix}.tier_ms", 0) / attempts, 1) if attempts else None,
+            # Includes the first tier's attempt
+            "escalated_avg_ms": round(counters.get(f"{prefix}.escalated_ms", 0) / escalated, 1) if escalated else None,
+            "rejected": {reason: counters.get(f"{prefix}.rejected.{reason}", 0) for reason in REJECT_REASONS},
+            "estimated_savings_usd": round(counters.get(f"{prefix}.saved_usd", 0), 6),
+        }
+    return result
@@ -0,0 +1,68 @@
+import threading
+from . import metrics
+from .deadline import DeadlineExceeded, remaining
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    De-duplicates concurrent calls with the same key: the first caller runs
+    the function, callers arriving while it is in flight wait for and share
+    its result or exception. Nothing is cached once the call finishes.
+
+    A leader can fail with DeadlineExceeded only because its own deadline
+    was shorter, so followers with time left run their own fn instead of
+    sharing that error.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, deadline=None):
+        follower = False
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self.calls[key] = call
+            if leader:
+                break
+
+            if not follower:
+                follower = True
+                metrics.incr("coalesce.followers")
+            if not call.done.wait(remaining(deadline)):
+                raise DeadlineExceeded("Request deadline exceeded")
+            if call.error is None:
+                return call.result
+            left = remaining(deadline)
+            if not isinstance(call.error, DeadlineExceeded) or (left is not None and left <= 0):
+                raise call.error
+            # Counted as a leader below, not as a request that shared a call
+            metrics.incr("coalesce.followers", -1)
+            metrics.incr("coalesce.takeovers")
+            follower = False
+
+        metrics.incr("coalesce.leaders")
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+# Shared by all upstream model calls in this process.
+group = SingleFlight()
@@ -0,0 +1,147 @@
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Stored values start with a one byte codec marker and the 4 byte id of the
+# dictionary they were compressed with (0 when none was used).
+RAW = b"r"
+ZLIB = b"z"
+ZSTD = b"s"
+CODECS = {"none": RAW, "zlib": ZLIB, "zstd": ZSTD}
+HEADER = struct.Struct(">cI")
+
+# Split points used to find repeated fragments when building zlib dictionaries
+_PIECES = re.compile(r"(?<=[.!?\n])\s*|(?<=\",) ")
+
+_dictionaries = {}
+_lock = threading.Lock()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured("HISTORY_COMPRESSION='zstd' requires the zstandard package")
+    return zstandard
+
+
+def dictionary_id(data):
+    """Ids are the CRC32 of the dictionary, never 0."""
+    return zlib.crc32(data) or 1
+
+
+def dictionary_path(dict_id):
+    return Path(settings.HISTORY_COMPRESSION_DICT_DIR) / f"{dict_id:08x}.dict"
+
+
+def load_dictionary(dict_id):
+    """Dictionary bytes for an id, cached after the first read."""
+    with _lock:
+        data = _dictionaries.get(dict_id)
+    if data is None:
+        path = dictionary_path(dict_id)
+        if not path.exists():
+            raise ImproperlyConfigured(f"Compression dictionary {path} is missing")
+        data = path.read_bytes()
+        with _lock:
+            _dictionaries[dict_id] = data
+    return data
+
+
+def active_dictionary():
+    """(id, bytes) of the dictionary new values are compressed with, or (0, None)."""
+    if not settings.HISTORY_COMPRESSION_DICT:
+        return 0, None
+    dict_id = int(settings.HISTORY_COMPRESSION_DICT, 16)
+    return dict_id, load_dictionary(dict_id)
+
+
+def compress(text, codec=None):
+    """Encode text to the stored byte format using codec (defaults to HISTORY_COMPRESSION)."""
+    codec = codec or settings.HISTORY_COMPRESSION
+    if codec not in CODECS:
+        raise ImproperlyConfigured(f"Unknown HISTORY_COMPRESSION codec {codec!r}")
+    data = text.encode("utf-8")
+    if codec == "none" or len(data) < settings.HISTORY_COMPRESSION_MIN_SIZE:
+        return HEADER.pack(RAW, 0) + data
+
+    dict_id, dictionary = active_dictionary()
+    if codec == "zlib":
+        if dictionary:
+            compressor = zlib.compressobj(settings.HISTORY_COMPRESSION_LEVEL, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(settings.HISTORY_COMPRESSION_LEVEL)
+        body = compressor.compress(data) + compressor.flush()
+    else:
+        zstandard = _zstd()
+        zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        body = zstandard.ZstdCompressor(level=settings.HISTORY_COMPRESSION_LEVEL, dict_data=zdict).compress(data)
+
+    # Keep short or incompressible values raw
+    if len(body) >= len(data):
+        return HEADER.pack(RAW, 0) + data
+    return HEADER.pack(CODECS[codec], dict_id) + body
+
+
+def decompress(value):
+    """Decode a stored value back to text. Plain strings from before the migration pass through."""
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    codec, dict_id = HEADER.unpack_from(value)
+    body = value[HEADER.size:]
+    if codec == RAW:
+        return body.decode("utf-8")
+
+    dictionary = load_dictionary(dict_id) if dict_id else None
+    if codec == ZLIB:
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        data = decompressor.decompress(body) + decompressor.flush()
+    elif codec == ZSTD:
+        zstandard = _zstd()
+        zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        data = zstandard.ZstdDecompressor(dict_data=zdict).decompress(body)
+    else:
+        raise ValueError(f"Unknown compression marker {codec!r}")
+    return data.decode("utf-8")
+
+
+def train_dictionary(samples, size, codec="zlib"):
+    """
+    Build a shared dictionary from sample texts. zstd uses its own trainer.
+    For zlib, sentences and lines that repeat across samples are ranked by
+    the bytes they would save and concatenated, most valuable last where
+    zlib finds them cheapest.
+    """
+    if codec == "zstd":
+        encoded = [sample.encode("utf-8") for sample in samples if sample]
+        return _zstd().train_dictionary(size, encoded).as_bytes()
+
+    counts = Counter()
+    for sample in samples:
+        counts.update(piece for piece in _PIECES.split(sample) if len(piece) > 8)
+    ranked = sorted((piece for piece, count in counts.items() if count > 1),
+                    key=lambda piece: counts[piece] * len(piece), reverse=True)
+    chosen = []
+    total = 0
+    for piece in ranked:
+        data = piece.encode("utf-8")
+        if total + len(data) > size:
+            continue
+        chosen.append(data)
+        total += len(data)
+    return b"".join(reversed(chosen))
+
+
+def save_dictionary(data):
+    """Write a dictionary to HISTORY_COMPRESSION_DICT_DIR and return its id."""
+    dict_id = dictionary_id(data)
+    path = dictionary_path(dict_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return dict_id
@@ -0,0 +1,65 @@
+import time
+from contextlib import contextmanager, ExitStack
+from django.db import connections, OperationalError
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request runs past the deadline set by DeadlineMiddleware.
+    """
+    pass
+
+
+def remaining(deadline):
+    """Seconds left before the deadline, None when there is no deadline."""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check(deadline):
+    """Raise DeadlineExceeded if the deadline has already passed."""
+    left = remaining(deadline)
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left
+
+
+class QueryDeadline:
+    """
+    Database execute wrapper that refuses to start queries after the
+    deadline. On SQLite a progress handler also interrupts a running query
+    once the deadline passes.
+    """
+    # Number of SQLite VM instructions between deadline checks
+    PROGRESS_STEPS = 1000
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __call__(self, execute, sql, params, many, context):
+        check(self.deadline)
+        connection = context["connection"]
+        sqlite = connection.vendor == "sqlite"
+        if sqlite:
+            connection.connection.set_progress_handler(self.expired, self.PROGRESS_STEPS)
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError:
+            check(self.deadline)
+            raise
+        finally:
+            if sqlite:
+                connection.connection.set_progress_handler(None, self.PROGRESS_STEPS)
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+
+@contextmanager
+def database_deadline(deadline):
+    """Apply the deadline to queries on every configured database alias."""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(QueryDeadline(deadline)))
+        yield
@@ -0,0 +1,61 @@
+import json
+import re
+
+# JSON schema every evaluation must follow. Sent to OpenAI as a strict
+# response format and to vLLM for guided decoding. The models were tuned to
+# write the score as "marks/total", so it stays a string here and parse()
+# turns it into a number.
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Score": {"type": "string"},
+        "Explanation": {"type": "string"},
+        "Feedback": {"type": "string"},
+    },
+    "required": ["Score", "Explanation", "Feedback"],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "evaluation", "strict": True, "schema": SCHEMA},
+}
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse(text):
+    """
+    Parse model output into {"Score": float, "Explanation": str,
+    "Feedback": str}. Returns None when the output is not a valid
+    evaluation. Text around the JSON object (code fences, a leading
+    sentence) is ignored.
+    """
+    if not text:
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+
+    fields = {name.lower(): value for name, value in data.items()}
+    score = fields.get("score")
+    if isinstance(score, str):
+        # "3/5" or "3 out of 5", the marks come first
+        match = _NUMBER.search(score)
+        score = float(match.group()) if match else None
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return None
+    explanation = fields.get("explanation")
+    feedback = fields.get("feedback")
+    if not isinstance(explanation, str) or not isinstance(feedback, str):
+        return None
+    return {"Score": float(score), "Explanation": explanation, "Feedback": feedback}
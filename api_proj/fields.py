@@ -0,0 +1,51 @@
+from django import forms
+from django.db import models
+from . import compression
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text field stored as a compressed BLOB. Values are compressed on save
+    with the HISTORY_COMPRESSION codec and decompressed when loaded, so the
+    ORM sees plain strings. Rows written before the column was converted
+    are still read as text.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('editable') is True:
+            del kwargs['editable']
+        return name, path, args, kwargs
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return compression.compress(value)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return compression.decompress(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return compression.decompress(value)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return forms.CharField(widget=forms.Textarea, required=not self.blank, **kwargs)
@@ -0,0 +1,41 @@
+from django.conf import settings
+from . import cascade, output_length, scheduler, semantic_cache, usage
+from .models import History
+
+
+def grade(subdomain, key, prompt, deadline=None, lane=scheduler.INTERACTIVE):
+    """
+    Evaluate one prompt for a key: reuse a near-duplicate answer when
+    enabled, otherwise call the backend (through its cascade, see
+    cascade.py), then store the History row and record usage. Shared by
+    AIView and bulk grading; lane is the scheduler lane of the upstream
+    call.
+    """
+    completion = None
+    if settings.NEAR_DUPLICATE_CACHE:
+        completion = semantic_cache.lookup(subdomain, prompt)
+    cached = completion is not None
+    if not cached:
+        completion = cascade.generate(subdomain, prompt, deadline=deadline, key=key, lane=lane)
+
+    # Save the history
+    history = History(
+        key=key,
+        input=prompt,
+        output=completion.text,
+        prompt_tokens=completion.prompt_tokens,
+        completion_tokens=completion.completion_tokens,
+        cached_tokens=completion.cached_tokens,
+        difficulty=output_length.difficulty(prompt),
+        truncated=completion.truncated,
+        backend=completion.backend or '',
+    )
+    if completion.evaluation is not None:
+        history.score = completion.evaluation["Score"]
+        history.explanation = completion.evaluation["Explanation"]
+        history.feedback = completion.evaluation["Feedback"]
+    history.save(using=subdomain)
+    usage.record(subdomain, key.id, completion)
+    if settings.NEAR_DUPLICATE_CACHE and not cached:
+        semantic_cache.add(subdomain, history)
+    return completion
@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from api_proj.archive import archive_history
+
+SUBDOMAINS = ["openai", "soc", "sci"]
+
+
+class Command(BaseCommand):
+    help = "Move History rows older than the retention period into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.HISTORY_RETENTION_DAYS,
+                            help="Archive rows older than this many days.")
+        parser.add_argument("--database", action="append", choices=SUBDOMAINS,
+                            help="Subdomain database to archive, can be repeated. Defaults to all.")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Rows per archive segment.")
+        parser.add_argument("--vacuum", action="store_true",
+                            help="VACUUM SQLite databases afterwards to give the space back.")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running and archive every INTERVAL hours.")
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once(options)
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"] * 3600)
+
+    def run_once(self, options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        for subdomain in options["database"] or SUBDOMAINS:
+            count = archive_history(subdomain, cutoff, options["batch_size"])
+            if count and options["vacuum"] and connections[subdomain].vendor == "sqlite":
+                with connections[subdomain].cursor() as cursor:
+                    cursor.execute("VACUUM")
+            self.stdout.write(f"{subdomain}: archived {count} rows older than {cutoff:%Y-%m-%d %H:%M}")
@@ -0,0 +1,99 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from api_proj import compression
+from api_proj.models import History
+
+SUBDOMAINS = ["openai", "soc", "sci"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare History storage codecs on a copy of real rows: database size, "
+        "estimated page-cache hit rate and history read latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", choices=SUBDOMAINS, default="openai",
+                            help="Subdomain database to take sample rows from.")
+        parser.add_argument("--rows", type=int, default=20000,
+                            help="Rows to write per codec; sample rows are repeated to reach it.")
+        parser.add_argument("--keys", type=int, default=20,
+                            help="Number of API keys the rows are spread over.")
+        parser.add_argument("--reads", type=int, default=200,
+                            help="History page reads to time per codec.")
+        parser.add_argument("--cache-kib", type=int, default=2000,
+                            help="SQLite page cache size in KiB (SQLite's default is 2000).")
+
+    def handle(self, *args, **options):
+        samples = list(History.objects.using(options["database"]).values_list("input", "output")[:1000])
+        if not samples:
+            raise CommandError(f"No History rows in {options['database']} to benchmark with")
+
+        codecs = ["none", "zlib"]
+        try:
+            compression._zstd()
+            codecs.append("zstd")
+        except ImproperlyConfigured:
+            pass
+
+        self.stdout.write(f"{'codec':<8} {'size KiB':>10} {'cache hit':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for codec in codecs:
+            result = self.run_codec(codec, samples, options)
+            self.stdout.write(
+                f"{codec:<8} {result['size'] / 1024:>10.1f} {result['hit_rate']:>10.1%} "
+                f"{result['p50'] * 1000:>8.2f} {result['p95'] * 1000:>8.2f}"
+            )
+        if settings.HISTORY_COMPRESSION_DICT:
+            self.stdout.write(f"Shared dictionary {settings.HISTORY_COMPRESSION_DICT} was used for compressed codecs")
+
+    def run_codec(self, codec, samples, options):
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "history.sqlite3")
+            db = sqlite3.connect(path)
+            db.execute("CREATE TABLE history (id INTEGER PRIMARY KEY, key_id INTEGER, input BLOB, output BLOB)")
+            db.execute("CREATE INDEX history_key ON history (key_id)")
+            rows = []
+            for i in range(options["rows"]):
+                input, output = samples[i % len(samples)]
+                rows.append((rng.randrange(options["keys"]),
+                             compression.compress(input, codec),
+                             compression.compress(output, codec)))
+            db.executemany("INSERT INTO history (key_id, input, output) VALUES (?, ?, ?)", rows)
+            db.commit()
+            db.execute("VACUUM")
+            page_size = db.execute("PRAGMA page_size").fetchone()[0]
+            page_count = db.execute("PRAGMA page_count").fetchone()[0]
+            db.close()
+
+            # Fresh connection so every codec starts with a cold SQLite cache
+            db = sqlite3.connect(path)
+            db.execute(f"PRAGMA cache_size = -{options['cache_kib']}")
+            latencies = []
+            for _ in range(options["reads"]):
+                key_id = rng.randrange(options["keys"])
+                start = time.perf_counter()
+                for input, output in db.execute(
+                        "SELECT input, output FROM history WHERE key_id = ? ORDER BY id DESC LIMIT 50", (key_id,)):
+                    compression.decompress(input)
+                    compression.decompress(output)
+                latencies.append(time.perf_counter() - start)
+            db.close()
+
+        latencies.sort()
+        cache_pages = options["cache_kib"] * 1024 // page_size
+        return {
+            "size": page_size * page_count,
+            # Python's sqlite3 does not expose cache statistics, so this is
+            # the hit rate uniform random reads would see: the share of the
+            # database's pages that fit in the page cache.
+            "hit_rate": min(1.0, cache_pages / page_count),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[int(len(latencies) * 0.95) - 1],
+        }
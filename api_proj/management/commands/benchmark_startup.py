@@ -0,0 +1,108 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api_proj.models import Keys
+
+SUBDOMAINS = ["openai", "soc", "sci"]
+HOSTS = {"openai": "opai.localhost", "soc": "op.soc.localhost", "sci": "op.sci.localhost"}
+
+# Runs in a fresh interpreter so imports are measured cold. Requests go
+# straight to the WSGI application, through the whole middleware stack.
+CHILD = """
+import io, json, os, sys, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+booted = time.perf_counter()
+ready_at = time.time()
+
+def request():
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": "/ai/info/", "QUERY_STRING": "",
+        "SERVER_NAME": "localhost", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": os.environ["BENCHMARK_HOST"], "HTTP_X_API_KEY": os.environ["BENCHMARK_API_KEY"],
+        "REMOTE_ADDR": "127.0.0.1", "wsgi.input": io.BytesIO(), "wsgi.errors": sys.stderr,
+        "wsgi.url_scheme": "http", "wsgi.version": (1, 0), "wsgi.multithread": True,
+        "wsgi.multiprocess": True, "wsgi.run_once": False,
+    }
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b"".join(body)
+    body.close()
+    if not statuses[0].startswith("200"):
+        raise SystemExit(f"GET /ai/info/ returned {statuses[0]}")
+
+t = time.perf_counter()
+request()
+first = time.perf_counter() - t
+latencies = []
+for _ in range(int(os.environ["BENCHMARK_REQUESTS"])):
+    t = time.perf_counter()
+    request()
+    latencies.append(time.perf_counter() - t)
+print(json.dumps({"boot": booted - start, "ready_at": ready_at, "first": first, "latencies": latencies,
+                  "modules": len(sys.modules)}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start (process ready, Django boot, first request) and "
+        "per-request overhead of GET /ai/info/ for each settings profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", default="AI_api.settings,AI_api.settings_api",
+                            help="Comma separated settings modules to compare.")
+        parser.add_argument("--database", choices=SUBDOMAINS, default="soc",
+                            help="Subdomain to send requests to; it needs at least one API key.")
+        parser.add_argument("--runs", type=int, default=5,
+                            help="Fresh processes started per profile.")
+        parser.add_argument("--requests", type=int, default=500,
+                            help="Requests timed per process after the first one.")
+
+    def handle(self, *args, **options):
+        api_key = Keys.objects.using(options["database"]).values_list("key", flat=True).first()
+        if api_key is None:
+            raise CommandError(f"No API key in {options['database']} to send requests with")
+
+        self.stdout.write(
+            f"{'profile':<22} {'modules':>8} {'ready ms':>9} {'boot ms':>8} {'first ms':>9} "
+            f"{'req p50 us':>11} {'req p95 us':>11}"
+        )
+        for profile in options["profiles"].split(","):
+            runs = [self.run_child(profile, api_key, options) for _ in range(options["runs"])]
+            latencies = sorted(latency for run in runs for latency in run["latencies"])
+            self.stdout.write(
+                f"{profile:<22} {runs[0]['modules']:>8} "
+                f"{statistics.median(run['ready'] for run in runs) * 1000:>9.0f} "
+                f"{statistics.median(run['boot'] for run in runs) * 1000:>8.0f} "
+                f"{statistics.median(run['first'] for run in runs) * 1000:>9.1f} "
+                f"{latencies[len(latencies) // 2] * 1e6:>11.0f} "
+                f"{latencies[int(len(latencies) * 0.95)] * 1e6:>11.0f}"
+            )
+
+    def run_child(self, profile, api_key, options):
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=profile,
+            BENCHMARK_HOST=HOSTS[options["database"]],
+            BENCHMARK_API_KEY=api_key,
+            BENCHMARK_REQUESTS=str(options["requests"]),
+        )
+        started = time.time()
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD], cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"{profile} failed:\n{result.stderr[-2000:]}")
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        # From spawning the interpreter until the application could serve
+        run["ready"] = run["ready_at"] - started
+        return run
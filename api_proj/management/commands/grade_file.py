@@ -0,0 +1,97 @@
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api_proj import bulk, grading, scheduler, usage
+from api_proj.deadline import database_deadline
+from api_proj.models import Keys
+from api_proj.routers import current_database
+
+SUBDOMAINS = ["openai", "soc", "sci"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Grade a CSV or JSON Lines file of question/answer/rubrics rows through the "
+        "same path as /ai/generate/, writing results as they complete. Rerun with the "
+        "same output file to resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="CSV or JSONL file with question, answer, rubrics, "
+                                          "total_marks and difficulty columns (id is copied to the output).")
+        parser.add_argument("--database", choices=SUBDOMAINS, required=True,
+                            help="Subdomain whose model grades the rows.")
+        parser.add_argument("--key", required=True,
+                            help="API key the rows are recorded and counted under.")
+        parser.add_argument("--output",
+                            help="Results file (.csv or .jsonl). Defaults to <input>.graded.jsonl.")
+        parser.add_argument("--concurrency", type=int, default=8,
+                            help="Rows sent to the model at once.")
+        parser.add_argument("--flush-every", type=int, default=100,
+                            help="Results written between flushes of the output file.")
+        parser.add_argument("--restart", action="store_true",
+                            help="Grade every row again instead of resuming from the output file.")
+
+    def handle(self, *args, **options):
+        alias = options["database"]
+        try:
+            key = Keys.objects.using(alias).get(key=options["key"])
+        except Keys.DoesNotExist:
+            raise CommandError(f"No such API key in {alias}")
+        output = options["output"] or f"{os.path.splitext(options['input'])[0]}.graded.jsonl"
+        try:
+            fmt = bulk.file_format(options["input"])
+            bulk.file_format(output)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options["restart"] and os.path.exists(output):
+            os.remove(output)
+        done = bulk.completed_rows(output)
+        if done:
+            self.stdout.write(f"Resuming, {len(done)} rows already graded in {output}")
+
+        def submit(prompt):
+            # Worker threads do not inherit the context of the command
+            current_database.set(alias)
+            deadline = time.monotonic() + settings.REQUEST_TIMEOUT_DEFAULT
+            with database_deadline(deadline):
+                return grading.grade(alias, key, prompt, deadline=deadline, lane=scheduler.BULK).evaluation
+
+        quota_hit = []
+
+        def stop():
+            # Same hard daily quota the API enforces
+            if key.daily_request_quota is None and key.daily_token_quota is None:
+                return False
+            if usage.quota_status(alias, key)[0] == "hard":
+                quota_hit.append(True)
+                return True
+            return False
+
+        started = time.monotonic()
+        progress = {"count": 0}
+
+        def on_result(result):
+            progress["count"] += 1
+            if progress["count"] % 1000 == 0:
+                rate = progress["count"] / (time.monotonic() - started)
+                self.stdout.write(f"{progress['count']} rows done ({rate:.1f}/s)")
+
+        with open(options["input"], newline="", encoding="utf-8") as handle, \
+                bulk.ResultWriter(output, options["flush_every"]) as writer:
+            try:
+                counts = bulk.run(
+                    bulk.read_rows(handle, fmt), submit, writer,
+                    concurrency=options["concurrency"], done=done, stop=stop, on_result=on_result,
+                )
+            except KeyboardInterrupt:
+                raise CommandError(f"Interrupted after {progress['count']} rows, rerun to resume")
+
+        self.stdout.write(
+            f"Graded {counts['graded']}, failed {counts['failed']}, skipped {counts['skipped']} "
+            f"in {time.monotonic() - started:.1f}s. Results in {output}"
+        )
+        if quota_hit:
+            raise CommandError("Stopped at the key's daily quota, rerun later to resume")
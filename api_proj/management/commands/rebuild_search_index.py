@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from api_proj import search
+
+SUBDOMAINS = ["openai", "soc", "sci"]
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of History, dropping entries of deleted rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", action="append", choices=SUBDOMAINS,
+                            help="Subdomain database to re-index, can be repeated. Defaults to all.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Rows read per batch.")
+
+    def handle(self, *args, **options):
+        for subdomain in options["database"] or SUBDOMAINS:
+            if not search.available(subdomain):
+                self.stdout.write(f"{subdomain}: full-text search needs SQLite, skipped")
+                continue
+            count = search.rebuild(subdomain, options["batch_size"])
+            self.stdout.write(f"{subdomain}: indexed {count} history rows")
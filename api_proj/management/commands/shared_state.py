@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api_proj.shared_state import SharedStateServer
+
+
+class Command(BaseCommand):
+    help = "Run the shared state daemon that worker processes on this host connect to."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=settings.SHARED_STATE_SOCKET,
+                            help="Unix socket path, defaults to SHARED_STATE_SOCKET.")
+
+    def handle(self, *args, **options):
+        if not options["socket"]:
+            raise CommandError("Set SHARED_STATE_SOCKET or pass --socket")
+        server = SharedStateServer(options["socket"], settings.SHARED_STATE_MAX_ENTRIES)
+        self.stdout.write(f"Shared state daemon listening on {options['socket']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from api_proj import compression
+from api_proj.models import History
+
+SUBDOMAINS = ["openai", "soc", "sci"]
+
+
+class Command(BaseCommand):
+    help = "Build a shared compression dictionary from existing History rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", action="append", choices=SUBDOMAINS,
+                            help="Subdomain database to sample, can be repeated. Defaults to all.")
+        parser.add_argument("--codec", choices=["zlib", "zstd"], default="zlib")
+        parser.add_argument("--samples", type=int, default=2000,
+                            help="Most recent rows to sample per database.")
+        parser.add_argument("--size", type=int, default=32768,
+                            help="Dictionary size in bytes. zlib only uses the last 32 KiB.")
+
+    def handle(self, *args, **options):
+        samples = []
+        for subdomain in options["database"] or SUBDOMAINS:
+            rows = History.objects.using(subdomain).order_by("-id").values_list("input", "output")[:options["samples"]]
+            for input, output in rows:
+                samples.extend([input, output])
+
+        data = compression.train_dictionary(samples, options["size"], options["codec"])
+        if not data:
+            self.stderr.write("Not enough repeated content to build a dictionary")
+            return
+        dict_id = compression.save_dictionary(data)
+        self.stdout.write(f"Wrote {len(data)} byte dictionary to {compression.dictionary_path(dict_id)}")
+        self.stdout.write(f"Enable it with HISTORY_COMPRESSION_DICT={dict_id:08x}")
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api_proj import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "List, add or remove the vLLM replicas behind soc and sci. Changes are written to "
+        "VLLM_REPLICAS_FILE and picked up by running workers within VLLM_HEALTH_INTERVAL seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "add", "remove"])
+        parser.add_argument("url", nargs="?", help="Replica base URL, as for VLLM_URL (without /v1).")
+        parser.add_argument("--no-check", action="store_true",
+                            help="Add a replica even if its /health endpoint does not answer.")
+
+    def handle(self, *args, **options):
+        urls = replicas.configured_urls()
+        if options["action"] == "list":
+            for url in urls:
+                state = "up" if replicas.probe(url) else "down"
+                self.stdout.write(f"{url}  {state}")
+            if not urls:
+                self.stdout.write("No vLLM replicas configured")
+            return
+
+        if not options["url"]:
+            raise CommandError(f"{options['action']} needs a replica URL")
+        if not settings.VLLM_REPLICAS_FILE:
+            raise CommandError("Set VLLM_REPLICAS_FILE to change replicas at runtime")
+        url = options["url"].rstrip("/")
+        if options["action"] == "add":
+            if url in urls:
+                raise CommandError(f"{url} is already a replica")
+            if not options["no_check"] and not replicas.probe(url):
+                raise CommandError(f"{url}/health does not answer, use --no-check to add it anyway")
+            urls.append(url)
+        else:
+            if url not in urls:
+                raise CommandError(f"{url} is not a replica")
+            urls.remove(url)
+        replicas.write_urls(urls)
+        self.stdout.write(f"{len(urls)} replicas in {settings.VLLM_REPLICAS_FILE}")
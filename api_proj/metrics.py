@@ -0,0 +1,24 @@
+import threading
+from collections import Counter
+
+# Process-wide counters, exposed through the /metrics/ endpoint.
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot():
+    """Copy of all counters, safe to serialize."""
+    with _lock:
+        return dict(_counters)
+
+
+def ratio(part, whole):
+    """part / whole rounded for display, 0 when nothing was counted yet."""
+    if not whole:
+        return 0.0
+    return round(part / whole, 4)
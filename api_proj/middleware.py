@@ -1,10 +1,93 @@
 from api_proj.models import Keys
-from user_agents import parse
+from api_proj.deadline import DeadlineExceeded, database_deadline
+from api_proj.routers import current_database
+from api_proj import capture, profiling, usage
+from api_proj.shared_state import get_store
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
 from django.http import JsonResponse
+import cProfile
 import hashlib
+import math
+import time
 import logging
 logger = logging.getLogger(__name__)
 
+class ProfilingMiddleware:
+    """
+    Middleware to record a cProfile trace of sampled requests and of
+    requests sent with the X-Profile token, see profiling.py. First in
+    MIDDLEWARE so the trace covers the whole chain and the view.
+    """
+    def __init__(self, get_response):
+        if not profiling.enabled():
+            # Not in the chain at all while profiling is off
+            raise MiddlewareNotUsed
+        if not settings.PROFILE_TOKEN:
+            # Sampled traces could never be listed or fetched
+            raise ImproperlyConfigured("PROFILE_SAMPLE_RATE requires PROFILE_TOKEN")
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = profiling.trigger(request)
+        if reason is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return self.get_response(request)
+        started = time.monotonic()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.monotonic() - started
+
+        profile_id = profiling.new_id()
+        try:
+            profiling.save(profile_id, profiler, {
+                "method": request.method,
+                "path": request.path,
+                "host": request.get_host(),
+                "status": response.status_code,
+                "duration_ms": round(duration * 1000, 1),
+                "trigger": reason,
+                "created": time.time(),
+            })
+        except OSError as e:
+            logger.warning(f"Could not save profile of {request.method} {request.path}: {e}")
+            return response
+        response['X-Profile-Id'] = profile_id
+        return response
+
+class CaptureMiddleware:
+    """
+    Middleware to record sampled requests for replay.py, see capture.py.
+    Near the top of MIDDLEWARE so the recorded duration covers the chain.
+    """
+    def __init__(self, get_response):
+        if not capture.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not capture.sampled(request):
+            return self.get_response(request)
+
+        body = request.body
+        started = time.time()
+        begin = time.monotonic()
+        response = self.get_response(request)
+        duration = time.monotonic() - begin
+        try:
+            capture.writer.write(capture.record(request, body, started, response, duration))
+        except OSError as e:
+            logger.warning(f"Could not capture {request.method} {request.path}: {e}")
+        return response
+
 class LoggingMiddleware:
     """
     Middleware to log requests and responses.
@@ -17,6 +100,8 @@ class LoggingMiddleware:
         ip_address = self.get_client_ip(request)
         
         # Parse user agent for device and browser info
+        # Imported here, its regex tables take a noticeable part of startup
+        from user_agents import parse
         user_agent_string = request.META.get('HTTP_USER_AGENT', '')
         user_agent = parse(user_agent_string)
         
@@ -52,6 +137,45 @@ class LoggingMiddleware:
             ip = request.META.get('REMOTE_ADDR')
         return ip
 
+class DeadlineMiddleware:
+    """
+    Middleware to give every request a deadline.
+    Clients may ask for a shorter budget with the X-Request-Timeout header (seconds),
+    the server caps it at REQUEST_TIMEOUT_MAX. The deadline is stored on
+    request.deadline for the upstream call and applied to all database queries.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timeout = settings.REQUEST_TIMEOUT_DEFAULT
+        header = request.headers.get('X-Request-Timeout')
+        if header:
+            try:
+                timeout = float(header)
+            except ValueError:
+                timeout = 0
+            # nan and inf would make the deadline never expire
+            if not math.isfinite(timeout) or timeout <= 0:
+                return JsonResponse(
+                    {"error": "X-Request-Timeout must be a positive number of seconds"},
+                    status=400
+                )
+        request.deadline = time.monotonic() + min(timeout, settings.REQUEST_TIMEOUT_MAX)
+
+        with database_deadline(request.deadline):
+            response = self.get_response(request)
+        return response
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, DeadlineExceeded):
+            logger.warning(f"Deadline exceeded for {request.method} {request.get_full_path()}")
+            return JsonResponse(
+                {"error": "Request deadline exceeded"},
+                status=504
+            )
+        return None
+
 class SubdomMiddleware:
     """
     Middleware to handle subdomain routing.
@@ -88,9 +212,40 @@ class SubdomMiddleware:
                 status=404
             )
 
-        response = self.get_response(request)
+        # Route this request's queries to the subdomain's database
+        token = current_database.set(request.subdomain)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_database.reset(token)
         return response
 
+def api_key_cache_key(alias, api_key):
+    return f"apikey:{alias}:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()}"
+
+# Keys fields kept in the shared key cache
+CACHED_KEY_FIELDS = ['id', 'key_name', 'key', 'daily_request_quota', 'daily_token_quota', 'scheduling_weight']
+
+def get_api_key(alias, api_key):
+    """
+    Look up a Keys row through the shared state cache, so workers do not
+    query the database for every request. Raises Keys.DoesNotExist.
+
+    A cached Keys object is partial: only CACHED_KEY_FIELDS are filled in,
+    the other fields (created_at) are deferred and cost a query when read.
+    Saving or deleting a key evicts its entry, see signals.py; changes made
+    with QuerySet.update() apply after API_KEY_CACHE_TTL.
+    """
+    store = get_store()
+    cache_key = api_key_cache_key(alias, api_key)
+    fields = store.get(cache_key)
+    if fields is None:
+        key = Keys.objects.get(key=api_key)
+        store.set(cache_key, {name: getattr(key, name) for name in CACHED_KEY_FIELDS}, settings.API_KEY_CACHE_TTL)
+        return key
+    names = [field.attname for field in Keys._meta.concrete_fields if field.attname in fields]
+    return Keys.from_db(alias, names, [fields[name] for name in names])
+
 class APIKeyAuthMiddleware:
     """
     Middleware to authenticate API requests using API keys.
@@ -102,7 +257,7 @@ class APIKeyAuthMiddleware:
         api_key = request.headers.get('X-API-KEY')
         if api_key:
             try:
-                key = Keys.objects.using(request.subdomain).get(key=api_key)
+                key = get_api_key(request.subdomain, api_key)
                 if key:
                     request.is_authenticated = True
                     request.key = key
@@ -115,6 +270,11 @@ class APIKeyAuthMiddleware:
                     {"error": "Invalid API key"},
                     status=401
                 )
+            except DeadlineExceeded:
+                return JsonResponse(
+                    {"error": "Request deadline exceeded"},
+                    status=504
+                )
             
         else:
             logger.warning("API key required but not provided from IP: {}".format(request.META.get('REMOTE_ADDR')))
@@ -126,6 +286,60 @@ class APIKeyAuthMiddleware:
         response = self.get_response(request)
         return response
 
+class RateLimitMiddleware:
+    """
+    Middleware to apply the per-minute request limits of RATE_LIMITS to
+    generation requests, counted per key in shared state so the limit
+    holds across worker processes.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        limit = settings.RATE_LIMITS.get(request.subdomain)
+        if request.method != 'POST' or not limit:
+            return self.get_response(request)
+
+        now = time.time()
+        window = int(now // 60)
+        count = get_store().incr(f"ratelimit:{request.subdomain}:{request.key.id}:{window}", 1, 60)
+        if count > limit:
+            logger.warning(f"Rate limit exceeded for key {request.key.key_name}")
+            response = JsonResponse(
+                {"error": f"Rate limit of {limit} requests per minute exceeded"},
+                status=429
+            )
+            response['Retry-After'] = str(int(60 - now % 60) + 1)
+            return response
+        return self.get_response(request)
+
+class QuotaMiddleware:
+    """
+    Middleware to enforce the daily request and token quotas of API keys.
+    Usage comes from the pre-aggregated counters, never from History.
+    Over the hard limit generation requests are rejected; past the soft
+    limit they go through with an X-Quota-Warning header.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method != 'POST':
+            return self.get_response(request)
+
+        state, requests_used, tokens_used = usage.quota_status(request.subdomain, request.key)
+        if state == "hard":
+            logger.warning(f"Quota exceeded for key {request.key.key_name}")
+            return JsonResponse(
+                {"error": "Daily quota exceeded", "requests": requests_used, "tokens": tokens_used},
+                status=429
+            )
+
+        response = self.get_response(request)
+        if state == "soft":
+            response['X-Quota-Warning'] = f"Daily quota nearly used: {requests_used} requests, {tokens_used} tokens"
+        return response
+
 class HashedMiddleware:
     def __init__(self,get_response):
         self.get_response = get_response
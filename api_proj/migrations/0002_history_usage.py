@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='cached_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='completion_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0002_history_usage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='history',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:23
+
+import api_proj.fields
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+
+
+def batches(History, db):
+    last = 0
+    while True:
+        rows = list(History.objects.using(db).filter(id__gt=last).order_by('id')
+                    .values_list('id', 'input', 'output')[:BATCH_SIZE])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def compress_rows(apps, schema_editor):
+    History = apps.get_model('api_proj', 'History')
+    db = schema_editor.connection.alias
+    # Rows from before this migration are read back as plain text
+    for rows in batches(History, db):
+        for pk, input, output in rows:
+            History.objects.using(db).filter(pk=pk).update(input=input, output=output)
+
+
+def decompress_rows(apps, schema_editor):
+    History = apps.get_model('api_proj', 'History')
+    db = schema_editor.connection.alias
+    with schema_editor.connection.cursor() as cursor:
+        for rows in batches(History, db):
+            for pk, input, output in rows:
+                cursor.execute(
+                    'UPDATE api_proj_history SET input = %s, output = %s WHERE id = %s',
+                    [input, output, pk],
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0003_history_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='history',
+            name='input',
+            field=api_proj.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='output',
+            field=api_proj.fields.CompressedTextField(),
+        ),
+        migrations.RunPython(compress_rows, decompress_rows),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0004_history_compressed_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keys',
+            name='daily_request_quota',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='keys',
+            name='daily_token_quota',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='UsageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('requests', models.IntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+                ('key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='api_proj.keys')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('key', 'period', 'period_start'), name='unique_usage_period')],
+            },
+        ),
+    ]
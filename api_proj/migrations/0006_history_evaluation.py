@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:27
+
+import json
+import re
+
+import api_proj.fields
+from django.db import migrations, models
+
+
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse(text):
+    """
+    evaluation.parse as it was when this migration was written, kept here
+    so the backfill gives the same result whatever the app's parser does
+    later.
+    """
+    if not text:
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+
+    fields = {name.lower(): value for name, value in data.items()}
+    score = fields.get("score")
+    if isinstance(score, str):
+        match = NUMBER.search(score)
+        score = float(match.group()) if match else None
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return None
+    explanation = fields.get("explanation")
+    feedback = fields.get("feedback")
+    if not isinstance(explanation, str) or not isinstance(feedback, str):
+        return None
+    return {"Score": float(score), "Explanation": explanation, "Feedback": feedback}
+
+
+def parse_existing(apps, schema_editor):
+    History = apps.get_model('api_proj', 'History')
+    db = schema_editor.connection.alias
+    last = 0
+    while True:
+        rows = list(History.objects.using(db).filter(id__gt=last).order_by('id').values_list('id', 'output')[:1000])
+        if not rows:
+            return
+        for pk, output in rows:
+            parsed = parse(output)
+            if parsed is not None:
+                History.objects.using(db).filter(pk=pk).update(
+                    score=parsed["Score"],
+                    explanation=parsed["Explanation"],
+                    feedback=parsed["Feedback"],
+                )
+        last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0005_usage_accounting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='explanation',
+            field=api_proj.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='feedback',
+            field=api_proj.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(parse_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+import json
+
+from django.db import migrations
+
+
+# The search index as it was when this migration was written, kept here so
+# the migration builds the same table whatever api_proj.search does later.
+TABLE = "api_proj_history_fts"
+BATCH_SIZE = 1000
+
+
+def index_text(text):
+    """The values of a JSON object, or the text itself."""
+    if not text:
+        return ""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(data, dict):
+        return "\n".join(str(value) for value in data.values() if value is not None)
+    return text
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    History = apps.get_model('api_proj', 'History')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "input, output, content='', tokenize='porter unicode61')"
+        )
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('delete-all')")
+        last = 0
+        while True:
+            rows = list(History.objects.using(connection.alias).filter(id__gt=last).order_by("id")
+                        .values_list("id", "input", "output")[:BATCH_SIZE])
+            if not rows:
+                return
+            cursor.executemany(
+                f"INSERT INTO {TABLE}(rowid, input, output) VALUES (%s, %s, %s)",
+                [(pk, index_text(input), index_text(output)) for pk, input, output in rows],
+            )
+            last = rows[-1][0]
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0006_history_evaluation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
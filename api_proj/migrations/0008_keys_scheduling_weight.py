@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0007_history_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keys',
+            name='scheduling_weight',
+            field=models.FloatField(default=1),
+        ),
+    ]
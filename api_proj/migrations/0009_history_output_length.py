@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:58
+
+import json
+
+from django.db import migrations, models
+
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+
+def difficulty(prompt):
+    """
+    output_length.difficulty as it was when this migration was written,
+    kept here so the backfill does not change with the app code.
+    """
+    try:
+        data = json.loads(prompt)
+    except (TypeError, ValueError):
+        return ""
+    if not isinstance(data, dict):
+        return ""
+    value = str(data.get("difficulty") or "").strip().lower()
+    return value if value in DIFFICULTIES else ""
+
+
+def set_difficulty(apps, schema_editor):
+    History = apps.get_model('api_proj', 'History')
+    db = schema_editor.connection.alias
+    last = 0
+    while True:
+        rows = list(History.objects.using(db).filter(id__gt=last).order_by('id').values_list('id', 'input')[:1000])
+        if not rows:
+            return
+        levels = {}
+        for pk, prompt in rows:
+            level = difficulty(prompt)
+            if level:
+                levels.setdefault(level, []).append(pk)
+        for level, ids in levels.items():
+            History.objects.using(db).filter(id__in=ids).update(difficulty=level)
+        last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0008_keys_scheduling_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='difficulty',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='truncated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(set_difficulty, migrations.RunPython.noop),
+    ]
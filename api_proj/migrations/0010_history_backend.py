@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_proj', '0009_history_output_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='backend',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from .fields import CompressedTextField
 
 # Create your models here.
 
@@ -6,15 +7,69 @@ class Keys(models.Model):
     key_name = models.CharField(max_length=255, unique=True)
     key = models.CharField(max_length=255, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Daily hard limits, empty means unlimited. A warning header is sent
+    # once USAGE_SOFT_QUOTA_RATIO of a limit is used.
+    daily_request_quota = models.IntegerField(null=True, blank=True)
+    daily_token_quota = models.IntegerField(null=True, blank=True)
+    # Share of the upstream slots this key gets while other keys are waiting
+    scheduling_weight = models.FloatField(default=1)
 
     def __str__(self):
         return f"{self.key_name} created at {self.created_at}"
 
 class History(models.Model):
     key = models.ForeignKey(Keys, on_delete=models.CASCADE, related_name='history')
-    timestamp = models.DateTimeField(auto_now_add=True)
-    input = models.TextField()
-    output = models.TextField()
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Stored compressed, see HISTORY_COMPRESSION in settings
+    input = CompressedTextField()
+    output = CompressedTextField()
+    # Token usage reported by the upstream model, cached_tokens counts the
+    # prompt prefix served from the provider's prompt cache.
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    cached_tokens = models.IntegerField(null=True, blank=True)
+    # Parsed evaluation, empty when the output could not be parsed
+    score = models.FloatField(null=True, blank=True)
+    explanation = CompressedTextField(null=True, blank=True)
+    feedback = CompressedTextField(null=True, blank=True)
+    # Difficulty from the prompt, for per-difficulty output length limits
+    difficulty = models.CharField(max_length=20, blank=True, default='', db_index=True)
+    # The stored output was cut off at max_tokens
+    truncated = models.BooleanField(default=False)
+    # Backend whose model wrote the output, which differs from the subdomain
+    # when a cascade tier answered; empty for rows saved before it was kept
+    backend = models.CharField(max_length=20, blank=True, default='')
+
+    def evaluation(self):
+        """The parsed evaluation in the API's response format, or None."""
+        if self.score is None:
+            return None
+        return {"Score": self.score, "Explanation": self.explanation, "Feedback": self.feedback}
 
     def __str__(self):
         return f"{self.key.key_name} - {self.input}, {self.output} at {self.timestamp}"
+
+
+class UsageCounter(models.Model):
+    """
+    Pre-aggregated usage of one key over one hour or day, so usage and
+    quotas never need to scan History.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    key = models.ForeignKey(Keys, on_delete=models.CASCADE, related_name='usage')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    requests = models.IntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'period', 'period_start'], name='unique_usage_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.key.key_name} {self.period} {self.period_start}: {self.requests} requests"
@@ -0,0 +1,85 @@
+"""
+Adaptive max_tokens. Decoding dominates the cost of a call, and an
+evaluation is much shorter than the fixed limits, so each backend and
+difficulty gets the MAX_TOKENS_PERCENTILE of its recent completion lengths
+from History, with MAX_TOKENS_MARGIN headroom, capped by the backend's
+MAX_TOKENS_CEILING. Limits are cached for MAX_TOKENS_REFRESH seconds.
+"""
+import json
+import math
+import threading
+import time
+from django.conf import settings
+from .models import History
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def difficulty(prompt):
+    """The difficulty of a JSON evaluation prompt, '' when missing or unknown."""
+    try:
+        data = json.loads(prompt)
+    except (TypeError, ValueError):
+        return ""
+    if not isinstance(data, dict):
+        return ""
+    value = str(data.get("difficulty") or "").strip().lower()
+    return value if value in DIFFICULTIES else ""
+
+
+def ceiling(backend):
+    """The backend's fixed limit, None for no limit."""
+    return settings.MAX_TOKENS_CEILING.get(backend)
+
+
+def percentile_limit(lengths):
+    """max_tokens for a sample of completion lengths, None if the sample is too small."""
+    if len(lengths) < settings.MAX_TOKENS_MIN_SAMPLES:
+        return None
+    lengths = sorted(lengths)
+    index = min(len(lengths) - 1, int(round(settings.MAX_TOKENS_PERCENTILE / 100 * (len(lengths) - 1))))
+    return max(settings.MAX_TOKENS_MIN, math.ceil(lengths[index] * settings.MAX_TOKENS_MARGIN))
+
+
+def compute(backend, level):
+    # Only outputs of the backend's own model; a cascade tier's answers
+    # stored in this database are written by another model
+    lengths = list(
+        History.objects.using(backend)
+        .filter(difficulty=level, completion_tokens__isnull=False, backend__in=(backend, ''))
+        .order_by('-id')
+        .values_list('completion_tokens', flat=True)[:settings.MAX_TOKENS_SAMPLE]
+    )
+    limit = percentile_limit(lengths)
+    top = ceiling(backend)
+    if limit is None:
+        return top
+    return min(limit, top) if top is not None else limit
+
+
+def max_tokens(backend, level=""):
+    """The current limit for a backend and difficulty, None for no limit."""
+    if not settings.ADAPTIVE_MAX_TOKENS:
+        return ceiling(backend)
+    now = time.monotonic()
+    with _limits_lock:
+        cached = _limits.get((backend, level))
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    limit = compute(backend, level)
+    with _limits_lock:
+        _limits[(backend, level)] = (now + settings.MAX_TOKENS_REFRESH, limit)
+    return limit
+
+
+def current_limits():
+    """Cached limits by backend and difficulty, for /metrics/."""
+    with _limits_lock:
+        limits = dict(_limits)
+    result = {}
+    for (backend, level), (_, limit) in sorted(limits.items()):
+        result.setdefault(backend, {})[level or "unspecified"] = limit
+    return result
@@ -0,0 +1,101 @@
+"""
+Opt-in cProfile traces of single requests.
+
+ProfilingMiddleware profiles a PROFILE_SAMPLE_RATE fraction of requests,
+and any request whose X-Profile header carries PROFILE_TOKEN. Each trace is
+written to PROFILE_DIR as <id>.prof (load it with pstats or snakeviz) next
+to <id>.json describing the request; only the newest PROFILE_MAX_FILES
+traces are kept. With both settings off the middleware removes itself at
+startup.
+"""
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import time
+from django.conf import settings
+
+PROFILE_HEADER = "X-Profile"
+
+_PROFILE_ID = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}$")
+
+
+def enabled():
+    return settings.PROFILE_SAMPLE_RATE > 0 or bool(settings.PROFILE_TOKEN)
+
+
+def authorized(request):
+    """True when the request carries the profiling token."""
+    token = request.headers.get(PROFILE_HEADER, "")
+    return bool(settings.PROFILE_TOKEN) and hmac.compare_digest(token, settings.PROFILE_TOKEN)
+
+
+def trigger(request):
+    """Why this request is profiled, "header" or "sample", or None."""
+    if authorized(request):
+        return "header"
+    if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def new_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+
+
+def path(profile_id, extension):
+    """File of a trace, None for ids that were not made by new_id()."""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    return os.path.join(settings.PROFILE_DIR, f"{profile_id}.{extension}")
+
+
+def save(profile_id, profiler, info):
+    """Write a trace and its description, then drop the oldest traces over PROFILE_MAX_FILES."""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(path(profile_id, "prof"))
+    with open(path(profile_id, "json"), "w", encoding="utf-8") as handle:
+        json.dump({"id": profile_id, **info}, handle)
+    for old in list_profiles()[settings.PROFILE_MAX_FILES:]:
+        for extension in ("prof", "json"):
+            try:
+                os.remove(path(old["id"], extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Descriptions of the stored traces, newest first."""
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(settings.PROFILE_DIR):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path, encoding="utf-8") as handle:
+                profiles.append(json.load(handle))
+        except (OSError, ValueError):
+            continue
+    return sorted(profiles, key=lambda profile: profile.get("created", 0), reverse=True)
+
+
+def load(profile_id):
+    """The description of a trace, None if there is no such trace."""
+    info_path = path(profile_id, "json")
+    if info_path is None or not os.path.exists(info_path):
+        return None
+    with open(info_path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def report(profile_id, sort="cumulative", limit=40):
+    """pstats text report of a trace, the top limit functions by sort."""
+    stream = io.StringIO()
+    stats = pstats.Stats(path(profile_id, "prof"), stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,277 @@
+"""
+Load balancing over the vLLM replicas that serve soc and sci.
+
+Every upstream attempt picks a replica: healthy replicas first, then the one
+with the fewest calls in flight from this process (VLLM_BALANCING=
+least_outstanding) or the lowest expected wait, in-flight calls times the
+average latency (VLLM_BALANCING=latency). A background thread probes each
+replica's /health every VLLM_HEALTH_INTERVAL seconds, opens keep-alive
+connections to new and recovered replicas before they get traffic, and
+re-reads VLLM_REPLICAS_FILE so replicas can be added and removed without a
+restart (see `manage.py vllm_replicas`).
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.request import urlopen
+from django.conf import settings
+from . import metrics
+from .upstream import UpstreamError
+import logging
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the latency moving average
+LATENCY_SMOOTHING = 0.2
+
+
+def configured_urls():
+    """
+    Replica base URLs: the lines of VLLM_REPLICAS_FILE when it exists
+    (blank lines and # comments ignored), otherwise VLLM_REPLICAS.
+    """
+    path = settings.VLLM_REPLICAS_FILE
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as handle:
+            lines = [line.split("#", 1)[0].strip() for line in handle]
+        urls = [line for line in lines if line]
+    else:
+        urls = list(settings.VLLM_REPLICAS)
+    # Same form as VLLM_URL: no trailing slash, no /v1
+    return list(dict.fromkeys(url.rstrip("/") for url in urls))
+
+
+def write_urls(urls):
+    """Replace VLLM_REPLICAS_FILE atomically, running workers pick it up on their next probe."""
+    path = settings.VLLM_REPLICAS_FILE
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        handle.write("".join(f"{url}\n" for url in urls))
+    os.replace(temporary, path)
+
+
+def probe(url, timeout=None):
+    """True when the replica answers its /health endpoint with 200."""
+    try:
+        with urlopen(f"{url}/health", timeout=timeout or settings.VLLM_HEALTH_TIMEOUT) as response:
+            return response.status == 200
+    except (OSError, ValueError):
+        return False
+
+
+def is_replica_fault(error):
+    """
+    Errors that say something about the replica rather than the request:
+    refused or dropped connections and 5xx responses. Timeouts are not
+    counted since they depend on the request deadline.
+    """
+    import openai
+    if isinstance(error, openai.APITimeoutError):
+        return False
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.healthy = True
+        # Removed from the pool, closed when its last call in flight ends
+        self.draining = False
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """OpenAI SDK client of the replica, whose connection pool is shared by all threads."""
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                # Retries are handled by the upstream policy, not the SDK
+                self._client = OpenAI(api_key="EMPTY", base_url=f"{self.url}/v1", max_retries=0)
+            return self._client
+
+    def warm(self, connections):
+        """Open up to connections keep-alive connections by listing the models concurrently."""
+        if connections <= 0:
+            return
+        client = self.client
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            list(executor.map(lambda _: client.models.list(timeout=settings.VLLM_HEALTH_TIMEOUT),
+                              range(connections)))
+
+    def close(self):
+        with self._client_lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def status(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "failures": self.failures,
+        }
+
+
+class ReplicaPool:
+    def __init__(self, urls):
+        self.lock = threading.Lock()
+        self.replicas = {}
+        self.update(urls)
+
+    def update(self, urls):
+        """Add new URLs and drop removed ones. Returns the replicas added."""
+        added = []
+        removed = []
+        idle = []
+        with self.lock:
+            for url in urls:
+                if url not in self.replicas:
+                    self.replicas[url] = Replica(url)
+                    added.append(self.replicas[url])
+            for url in list(self.replicas):
+                if url not in urls:
+                    replica = self.replicas.pop(url)
+                    removed.append(replica)
+                    # Calls in flight keep their own reference and finish
+                    # normally, the last one closes the client
+                    replica.draining = True
+                    if replica.outstanding == 0:
+                        idle.append(replica)
+        for replica in added:
+            logger.info(f"Added vLLM replica {replica.url}")
+        for replica in removed:
+            logger.info(f"Removed vLLM replica {replica.url}")
+        for replica in idle:
+            replica.close()
+        return added
+
+    def pick(self):
+        with self.lock:
+            replicas = list(self.replicas.values())
+            if not replicas:
+                raise UpstreamError("No vLLM replicas configured")
+            # Fail open: with every replica marked down, try them anyway
+            candidates = [replica for replica in replicas if replica.healthy] or replicas
+            scores = {replica.url: self._score(replica) for replica in candidates}
+            best = min(scores.values())
+            replica = random.choice([replica for replica in candidates if scores[replica.url] == best])
+            replica.outstanding += 1
+            return replica
+
+    def _score(self, replica):
+        # Replicas that failed since their last good call or probe go last
+        if settings.VLLM_BALANCING == "latency":
+            return replica.failures > 0, (replica.outstanding + 1) * (replica.latency or 0)
+        return replica.failures > 0, replica.outstanding
+
+    @contextmanager
+    def acquire(self):
+        """Hold a replica for one upstream attempt and record how it went."""
+        replica = self.pick()
+        started = time.monotonic()
+        try:
+            yield replica
+        except Exception as e:
+            if is_replica_fault(e):
+                self.failed(replica)
+            raise
+        else:
+            self.succeeded(replica, time.monotonic() - started)
+        finally:
+            with self.lock:
+                replica.outstanding -= 1
+                drained = replica.draining and replica.outstanding == 0
+            if drained:
+                replica.close()
+
+    def succeeded(self, replica, seconds):
+        with self.lock:
+            replica.failures = 0
+            if replica.latency is None:
+                replica.latency = seconds
+            else:
+                replica.latency += LATENCY_SMOOTHING * (seconds - replica.latency)
+
+    def failed(self, replica):
+        with self.lock:
+            replica.failures += 1
+            if replica.healthy and replica.failures >= settings.VLLM_UNHEALTHY_AFTER:
+                replica.healthy = False
+                logger.warning(f"vLLM replica {replica.url} marked down after {replica.failures} failed calls")
+        metrics.incr("vllm.replica_failures")
+
+    def check(self):
+        """Probe every replica once, warming the connections of those that come back up."""
+        for replica in list(self.replicas.values()):
+            healthy = probe(replica.url)
+            with self.lock:
+                recovered = healthy and not replica.healthy
+                if healthy:
+                    replica.failures = 0
+                elif replica.healthy:
+                    logger.warning(f"vLLM replica {replica.url} failed its health check")
+                replica.healthy = healthy
+            if recovered:
+                logger.info(f"vLLM replica {replica.url} is back up")
+                self.warm([replica])
+
+    def warm(self, replicas):
+        for replica in replicas:
+            try:
+                replica.warm(settings.VLLM_WARM_CONNECTIONS)
+            except Exception as e:
+                logger.warning(f"Could not warm connections to vLLM replica {replica.url}: {e}")
+
+    def status(self):
+        with self.lock:
+            return [replica.status() for replica in self.replicas.values()]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process's replica pool, started with its health checker on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ReplicaPool(configured_urls())
+            threading.Thread(target=_monitor, args=(_pool,), name="vllm-replicas", daemon=True).start()
+        return _pool
+
+
+def start():
+    """Create the pool and warm its connections now, e.g. when a server worker boots."""
+    pool = get_pool()
+    pool.warm(list(pool.replicas.values()))
+
+
+def status():
+    """State of each replica in this process, empty before the first vLLM call."""
+    return _pool.status() if _pool is not None else []
+
+
+def _monitor(pool):
+    mtime = None
+    while True:
+        path = settings.VLLM_REPLICAS_FILE
+        try:
+            current = os.path.getmtime(path) if path and os.path.exists(path) else None
+            if current != mtime:
+                mtime = current
+                pool.warm(pool.update(configured_urls()))
+            pool.check()
+        except Exception:
+            logger.exception("vLLM replica health check failed")
+        time.sleep(settings.VLLM_HEALTH_INTERVAL)
@@ -0,0 +1,29 @@
+from contextvars import ContextVar
+from django.db import DEFAULT_DB_ALIAS
+
+# Database alias of the subdomain the current request was routed to.
+current_database = ContextVar('current_database', default=None)
+
+
+class SubdomainRouter:
+    """
+    Sends queries to the database of the request's subdomain, as set by
+    SubdomMiddleware. Explicit .using() calls (management commands,
+    background work) still take precedence.
+    """
+    def db_for_read(self, model, **hints):
+        return current_database.get()
+
+    def db_for_write(self, model, **hints):
+        return current_database.get()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db and obj2._state.db:
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 'default' is left empty, every subdomain database gets all apps
+        if db == DEFAULT_DB_ALIAS:
+            return False
+        return None
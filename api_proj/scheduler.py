@@ -0,0 +1,175 @@
+"""
+Weighted fair scheduling of upstream calls.
+
+Each backend has a fixed number of slots (UPSTREAM_SLOTS) per process.
+Calls beyond that wait in a queue per lane and API key, and free slots are
+handed out with deficit round-robin on two levels: first between the
+interactive and bulk lanes by SCHEDULER_LANE_WEIGHTS, then between the
+keys waiting in the chosen lane by Keys.scheduling_weight. A key with
+weight 2 gets twice the slots of a key with weight 1 while both are
+waiting, and a large bulk run cannot hold every slot while interactive
+requests queue behind it.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+from . import metrics
+from .deadline import DeadlineExceeded, remaining
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+class _DeficitRoundRobin:
+    """
+    Deficit round-robin over flows that have waiting calls, each call
+    costing 1. A flow at the head of the round gets its weight added to
+    its deficit and is served while the deficit lasts, then moves to the
+    back.
+    """
+    def __init__(self):
+        self.active = deque()
+        self.deficit = {}
+
+    def activate(self, flow):
+        if flow not in self.deficit:
+            self.deficit[flow] = 0.0
+            self.active.append(flow)
+
+    def deactivate(self, flow):
+        # An idle flow does not keep credit for later
+        if self.deficit.pop(flow, None) is not None:
+            self.active.remove(flow)
+
+    def pick(self, weight):
+        while True:
+            flow = self.active[0]
+            if self.deficit[flow] < 1:
+                self.deficit[flow] += max(weight(flow), 0.01)
+            if self.deficit[flow] >= 1:
+                self.deficit[flow] -= 1
+                if self.deficit[flow] < 1:
+                    self.active.rotate(-1)
+                return flow
+            self.active.rotate(-1)
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "lane", "key")
+
+    def __init__(self, lane, key):
+        self.event = threading.Event()
+        self.granted = False
+        self.lane = lane
+        self.key = key
+
+
+class FairScheduler:
+    """Slots of one backend, shared by all threads of the process."""
+    def __init__(self, slots, lane_weights):
+        self.lock = threading.Lock()
+        self.free = slots
+        self.lane_weights = lane_weights
+        self.lanes = _DeficitRoundRobin()
+        self.keys = {lane: _DeficitRoundRobin() for lane in LANES}
+        self.queues = {}
+        self.key_weights = {}
+
+    def acquire(self, key, weight=1, lane=INTERACTIVE, deadline=None):
+        """Wait for a slot; raises DeadlineExceeded if the deadline passes first."""
+        waiter = _Waiter(lane, key)
+        with self.lock:
+            self.key_weights[key] = weight
+            self.queues.setdefault((lane, key), deque()).append(waiter)
+            self.keys[lane].activate(key)
+            self.lanes.activate(lane)
+            self._dispatch()
+        if waiter.event.wait(remaining(deadline)):
+            return
+        with self.lock:
+            if waiter.granted:
+                # Granted while timing out, the caller gets the slot after all
+                return
+            self._forget(waiter)
+        raise DeadlineExceeded("Request deadline exceeded while queued for the model")
+
+    def release(self):
+        with self.lock:
+            self.free += 1
+            self._dispatch()
+
+    def waiting(self):
+        """Queued calls per lane."""
+        with self.lock:
+            counts = dict.fromkeys(LANES, 0)
+            for (lane, _), queue in self.queues.items():
+                counts[lane] += len(queue)
+            return counts
+
+    def _dispatch(self):
+        while self.free > 0 and self.lanes.active:
+            lane = self.lanes.pick(lambda lane: self.lane_weights.get(lane, 1))
+            key = self.keys[lane].pick(lambda key: self.key_weights.get(key, 1))
+            waiter = self.queues[(lane, key)].popleft()
+            self._drop_if_idle(lane, key)
+            waiter.granted = True
+            self.free -= 1
+            waiter.event.set()
+
+    def _forget(self, waiter):
+        queue = self.queues.get((waiter.lane, waiter.key))
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._drop_if_idle(waiter.lane, waiter.key)
+
+    def _drop_if_idle(self, lane, key):
+        if not self.queues[(lane, key)]:
+            del self.queues[(lane, key)]
+            self.keys[lane].deactivate(key)
+            if not self.keys[lane].active:
+                self.lanes.deactivate(lane)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(backend):
+    """The scheduler of a backend, None when UPSTREAM_SLOTS does not limit it."""
+    slots = settings.UPSTREAM_SLOTS.get(backend)
+    if not slots:
+        return None
+    with _schedulers_lock:
+        if backend not in _schedulers:
+            _schedulers[backend] = FairScheduler(slots, settings.SCHEDULER_LANE_WEIGHTS)
+        return _schedulers[backend]
+
+
+def waiting():
+    """Calls queued for a slot, per backend and lane, in this process."""
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {backend: scheduler.waiting() for backend, scheduler in schedulers.items()}
+
+
+@contextmanager
+def slot(backend, key, weight=1, lane=INTERACTIVE, deadline=None):
+    """
+    Hold one of the backend's upstream slots for the duration of the block.
+    key identifies the caller's flow, (database, key id) for an API key.
+    """
+    scheduler = get_scheduler(backend)
+    if scheduler is None:
+        yield
+        return
+    started = time.monotonic()
+    scheduler.acquire(key, weight, lane, deadline)
+    metrics.incr(f"scheduler.{lane}.calls")
+    metrics.incr(f"scheduler.{lane}.wait_ms", int((time.monotonic() - started) * 1000))
+    try:
+        yield
+    finally:
+        scheduler.release()
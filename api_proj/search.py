@@ -0,0 +1,138 @@
+"""
+Full-text search over History input and output, backed by an SQLite FTS5
+table in each subdomain database.
+
+The index is contentless: History keeps the (possibly compressed) text and
+the index only maps terms to History ids. SQL triggers cannot read the
+compressed columns, so rows are indexed from Python when they are saved
+(see signals.py). Rows deleted without going through remove() leave stale
+index entries; searches join back to History, so they are never returned,
+and `manage.py rebuild_search_index` drops them.
+"""
+import json
+import re
+from django.db import connections
+from .models import History
+
+TABLE = "api_proj_history_fts"
+FIELDS = ("input", "output")
+
+_TERM = re.compile(r"\w+\*?")
+
+
+def available(alias):
+    return connections[alias].vendor == "sqlite"
+
+
+def create_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "input, output, content='', tokenize='porter unicode61')"
+        )
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def index_text(text):
+    """
+    The text indexed for a stored prompt or evaluation: the values of a
+    JSON object, so field names shared by every row are not indexed.
+    """
+    if not text:
+        return ""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(data, dict):
+        return "\n".join(str(value) for value in data.values() if value is not None)
+    return text
+
+
+def add(alias, rows):
+    """Index (id, input, output) rows."""
+    with connections[alias].cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {TABLE}(rowid, input, output) VALUES (%s, %s, %s)",
+            [(pk, index_text(input), index_text(output)) for pk, input, output in rows],
+        )
+
+
+def remove(alias, rows):
+    """
+    Drop (id, input, output) rows from the index. A contentless index needs
+    the original text to find the terms to remove.
+    """
+    with connections[alias].cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {TABLE}({TABLE}, rowid, input, output) VALUES ('delete', %s, %s, %s)",
+            [(pk, index_text(input), index_text(output)) for pk, input, output in rows],
+        )
+
+
+def rebuild(alias, batch_size=1000):
+    """Re-index every History row of a database. Returns the number of rows indexed."""
+    connection = connections[alias]
+    create_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('delete-all')")
+    count = 0
+    last = 0
+    while True:
+        rows = list(History.objects.using(alias).filter(id__gt=last).order_by("id")
+                    .values_list("id", "input", "output")[:batch_size])
+        if not rows:
+            return count
+        add(alias, rows)
+        count += len(rows)
+        last = rows[-1][0]
+
+
+def match_query(text, field=None):
+    """
+    An FTS5 query matching rows that contain every word of text, with a
+    trailing * as a prefix match. Returns None if text has no words.
+    """
+    terms = []
+    for term in _TERM.findall(text.lower()):
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        if term:
+            terms.append(f'"{term}"*' if prefix else f'"{term}"')
+    if not terms:
+        return None
+    query = " ".join(terms)
+    if field is not None:
+        query = f"{field} : ({query})"
+    return query
+
+
+def search(alias, key_id, query, limit, offset=0):
+    """
+    (ids ordered by relevance, total matches) for an FTS5 query, limited to
+    the History rows of one key.
+    """
+    history = History._meta.db_table
+    where = f"{TABLE} MATCH %s AND h.key_id = %s"
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f"SELECT h.id FROM {TABLE} JOIN {history} h ON h.id = {TABLE}.rowid "
+            f"WHERE {where} ORDER BY bm25({TABLE}) LIMIT %s OFFSET %s",
+            [query, key_id, limit, offset],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            f"SELECT count(*) FROM {TABLE} JOIN {history} h ON h.id = {TABLE}.rowid WHERE {where}",
+            [query, key_id],
+        )
+        total = cursor.fetchone()[0]
+    return ids, total
+
+
+def matching_ids(query):
+    """SQL and params selecting the ids of History rows matching an FTS5 query, for RawSQL."""
+    return f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [query]
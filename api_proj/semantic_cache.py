@@ -0,0 +1,203 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import zlib
+from django.conf import settings
+from django.db import connections
+from . import metrics
+from .backends import Completion, PROMPT_LAST_FIELD
+from .models import History
+import logging
+logger = logging.getLogger(__name__)
+
+# MinHash parameters. NUM_PERM = BANDS * ROWS; 16 bands of 4 rows put the
+# LSH candidate threshold around Jaccard 0.5, the final decision is made
+# against NEAR_DUPLICATE_THRESHOLD on the estimated similarity.
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+SHINGLE_SIZE = 5
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1337)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = _PUNCTUATION.sub(" ", str(text).lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def split_prompt(prompt):
+    """
+    Split an evaluation prompt into (context, answer). Answers are only
+    compared when question, rubric, marks and difficulty match exactly,
+    so the context is reduced to a hash. Non-JSON prompts have no context.
+    """
+    try:
+        data = json.loads(prompt)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        return "", normalize(prompt)
+
+    answer = data.pop(PROMPT_LAST_FIELD, "")
+    context = {field: normalize(value) for field, value in data.items()}
+    context_hash = hashlib.sha256(json.dumps(context, sort_keys=True).encode('utf-8')).hexdigest()
+    return context_hash, normalize(answer)
+
+
+def signature(text):
+    """MinHash signature over character shingles of normalized text."""
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """
+    In-memory MinHash/LSH index of past History inputs for one subdomain.
+    Entries map to History ids; the stored output is read back on a hit.
+    Only rows whose output parsed as an evaluation are indexed.
+    Once NEAR_DUPLICATE_MAX_ENTRIES is reached the oldest entry is evicted.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signatures = {}
+        self.buckets = {}
+        # Set once the recent History rows are loaded, see get_index()
+        self.ready = threading.Event()
+
+    def _bands(self, context, sig):
+        for band in range(BANDS):
+            yield (context, band, sig[band * ROWS:(band + 1) * ROWS])
+
+    def add(self, history_id, prompt):
+        context, answer = split_prompt(prompt)
+        if not answer:
+            return
+        sig = signature(answer)
+        with self.lock:
+            if len(self.signatures) >= settings.NEAR_DUPLICATE_MAX_ENTRIES:
+                oldest = next(iter(self.signatures))
+                old_context, old_sig = self.signatures.pop(oldest)
+                for bucket in self._bands(old_context, old_sig):
+                    self.buckets[bucket].discard(oldest)
+                    if not self.buckets[bucket]:
+                        del self.buckets[bucket]
+            self.signatures[history_id] = (context, sig)
+            for bucket in self._bands(context, sig):
+                self.buckets.setdefault(bucket, set()).add(history_id)
+
+    def find(self, prompt):
+        """Return (history_id, similarity) of the closest match above the threshold, or None."""
+        context, answer = split_prompt(prompt)
+        if not answer:
+            return None
+        sig = signature(answer)
+        with self.lock:
+            candidates = set()
+            for bucket in self._bands(context, sig):
+                candidates.update(self.buckets.get(bucket, ()))
+            scored = [(similarity(sig, self.signatures[hid][1]), hid) for hid in candidates]
+        if not scored:
+            return None
+        score, history_id = max(scored)
+        if score < settings.NEAR_DUPLICATE_THRESHOLD:
+            return None
+        return history_id, score
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def load(subdomain, index):
+    """Fill an index from the most recent History rows, then mark it ready."""
+    rows = list(History.objects.using(subdomain)
+                .filter(score__isnull=False)
+                .order_by('-id')
+                .values_list('id', 'input')[:settings.NEAR_DUPLICATE_MAX_ENTRIES])
+    for history_id, prompt in reversed(rows):
+        # Rows saved while loading were added already
+        if history_id not in index.signatures:
+            index.add(history_id, prompt)
+    index.ready.set()
+    logger.info(f"Built near-duplicate index for {subdomain} with {len(index.signatures)} entries")
+
+
+def _load_in_background(subdomain, index):
+    try:
+        load(subdomain, index)
+    except Exception:
+        logger.exception(f"Could not build the near-duplicate index for {subdomain}")
+        # The next request starts over
+        with _indexes_lock:
+            if _indexes.get(subdomain) is index:
+                del _indexes[subdomain]
+    finally:
+        connections.close_all()
+
+
+def start_loading(subdomain, index):
+    threading.Thread(target=_load_in_background, args=(subdomain, index),
+                     name=f"near-duplicate-{subdomain}", daemon=True).start()
+
+
+def get_index(subdomain):
+    """
+    The subdomain's index. The first call creates it and starts loading
+    recent History rows on a background thread, once per subdomain;
+    lookups are skipped until index.ready is set.
+    """
+    with _indexes_lock:
+        index = _indexes.get(subdomain)
+        if index is not None:
+            return index
+        index = _indexes[subdomain] = NearDuplicateIndex()
+    start_loading(subdomain, index)
+    return index
+
+
+def lookup(subdomain, prompt):
+    """
+    Return a Completion with the stored evaluation of a near-identical past
+    answer, or None on a miss.
+    """
+    index = get_index(subdomain)
+    if not index.ready.is_set():
+        metrics.incr("near_duplicate.not_ready")
+        return None
+    match = index.find(prompt)
+    if match is not None:
+        history_id, score = match
+        output = (History.objects.using(subdomain).filter(id=history_id, score__isnull=False)
+                  .values_list('output', flat=True).first())
+        completion = Completion(output) if output is not None else None
+        # Never re-serve an output the structured output retries would reject
+        if completion is not None and completion.evaluation is not None:
+            metrics.incr("near_duplicate.hits")
+            logger.info(f"Near-duplicate cache hit on {subdomain} history {history_id} (similarity {score:.2f})")
+            return completion
+    metrics.incr("near_duplicate.misses")
+    return None
+
+
+def add(subdomain, history):
+    """Index a freshly saved History row if its output parsed as an evaluation."""
+    if history.score is None:
+        return
+    get_index(subdomain).add(history.id, history.input)
@@ -0,0 +1,222 @@
+"""
+Key-value state shared by all worker processes on one host.
+
+Store is an in-memory map with atomic counters, per-key TTLs and LRU
+eviction. With SHARED_STATE_SOCKET set, every worker talks to one Store
+held by the `manage.py shared_state` daemon over a Unix socket; without it
+each process uses its own Store, which is enough for `runserver`.
+Values must be JSON serializable.
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+import logging
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct(">I")
+
+
+class Store:
+    """
+    Thread-safe in-memory store. Reads refresh an entry's LRU position,
+    expired entries are dropped when touched or evicted.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def _live(self, key, now):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return entry
+
+    def _put(self, key, value, ttl, now):
+        self.data[key] = (value, now + ttl if ttl else None)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            entry = self._live(key, time.monotonic())
+            return None if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._put(key, value, ttl, time.monotonic())
+
+    def add(self, key, value, ttl=None):
+        """Set key only if it is missing; returns whether it was set."""
+        with self.lock:
+            now = time.monotonic()
+            if self._live(key, now) is not None:
+                return False
+            self._put(key, value, ttl, now)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        """
+        Atomically add amount to a counter and return the new value. A
+        missing counter starts at 0 and gets ttl; later increments keep
+        the original expiry.
+        """
+        with self.lock:
+            now = time.monotonic()
+            entry = self._live(key, now)
+            if entry is None:
+                value = amount
+                self._put(key, value, ttl, now)
+            else:
+                value = entry[0] + amount
+                self.data[key] = (value, entry[1])
+            return value
+
+
+def _send(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _receive(sock):
+    header = _read_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    data = _read_exactly(sock, _LENGTH.unpack(header)[0])
+    return json.loads(data) if data is not None else None
+
+
+def _read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+OPERATIONS = {"get", "set", "add", "delete", "incr"}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        store = self.server.store
+        while True:
+            message = _receive(self.request)
+            if message is None:
+                return
+            op = message.get("op")
+            if op not in OPERATIONS:
+                _send(self.request, {"error": f"unknown operation {op!r}"})
+                continue
+            try:
+                result = getattr(store, op)(*message.get("args", []))
+                _send(self.request, {"result": result})
+            except Exception as e:
+                _send(self.request, {"error": str(e)})
+
+
+class SharedStateServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, max_entries):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.store = Store(max_entries)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+
+class SharedStateClient:
+    """
+    Store interface backed by the shared_state daemon. Each thread keeps
+    its own connection. If the daemon cannot be reached the call falls
+    back to a process-local Store, so requests keep working with
+    per-process state instead of failing.
+    """
+    def __init__(self, path, fallback):
+        self.path = path
+        self.fallback = fallback
+        self.local = threading.local()
+        self.available = True
+
+    def _connection(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(settings.SHARED_STATE_TIMEOUT)
+            sock.connect(self.path)
+            self.local.sock = sock
+        return sock
+
+    def _call(self, op, *args):
+        try:
+            sock = self._connection()
+            _send(sock, {"op": op, "args": list(args)})
+            reply = _receive(sock)
+            if reply is None:
+                raise ConnectionError("shared state daemon closed the connection")
+        except (OSError, ValueError) as e:
+            sock = getattr(self.local, "sock", None)
+            if sock is not None:
+                sock.close()
+                self.local.sock = None
+            if self.available:
+                logger.warning(f"Shared state daemon unavailable ({e}), using process-local state")
+                self.available = False
+            return getattr(self.fallback, op)(*args)
+        if not self.available:
+            logger.info("Shared state daemon reachable again")
+            self.available = True
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    def get(self, key):
+        return self._call("get", key)
+
+    def set(self, key, value, ttl=None):
+        return self._call("set", key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        return self._call("add", key, value, ttl)
+
+    def delete(self, key):
+        return self._call("delete", key)
+
+    def incr(self, key, amount=1, ttl=None):
+        return self._call("incr", key, amount, ttl)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The shared store of this host, or a process-local one without SHARED_STATE_SOCKET."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            local = Store(settings.SHARED_STATE_MAX_ENTRIES)
+            if settings.SHARED_STATE_SOCKET:
+                _store = SharedStateClient(settings.SHARED_STATE_SOCKET, local)
+            else:
+                _store = local
+        return _store
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from api_proj.middleware import api_key_cache_key
+from api_proj import search
+from api_proj.models import History, Keys
+from api_proj.shared_state import get_store
+
+
+@receiver(pre_save, sender=Keys)
+def remember_key_value(sender, instance, using, **kwargs):
+    """Note the stored key value, a changed one has to be evicted too."""
+    if instance.pk is not None and not instance._state.adding:
+        instance._stored_key = Keys.objects.using(using).filter(pk=instance.pk).values_list('key', flat=True).first()
+
+
+@receiver(post_save, sender=Keys)
+@receiver(post_delete, sender=Keys)
+def forget_cached_key(sender, instance, using, **kwargs):
+    """Drop the cached copy of a key so quota or key changes apply at once."""
+    store = get_store()
+    store.delete(api_key_cache_key(using, instance.key))
+    stored = getattr(instance, '_stored_key', None)
+    if stored and stored != instance.key:
+        store.delete(api_key_cache_key(using, stored))
+
+
+@receiver(post_save, sender=History)
+def index_history(sender, instance, created, using, **kwargs):
+    """Add new History rows to the full-text index of their database."""
+    if created and search.available(using):
+        search.add(using, [(instance.pk, instance.input, instance.output)])
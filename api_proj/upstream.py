@@ -0,0 +1,185 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from django.conf import settings
+from .deadline import check, remaining
+import logging
+logger = logging.getLogger(__name__)
+
+# Thread pool used to run hedged duplicates of slow upstream calls. Primary
+# calls get a thread of their own, so this does not cap concurrency.
+_executor = ThreadPoolExecutor(max_workers=settings.UPSTREAM_HEDGE_WORKERS, thread_name_prefix="upstream-hedge")
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream model call still fails after the retry policy
+    gave up. status_code is the last upstream status, if there was one.
+    """
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of successful call latencies for one backend and
+    answers percentile queries for the hedging delay.
+    """
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct):
+        with self.lock:
+            samples = sorted(self.samples)
+        if len(samples) < settings.UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def latency_tracker(backend):
+    with _latencies_lock:
+        if backend not in _latencies:
+            _latencies[backend] = LatencyTracker(settings.UPSTREAM_LATENCY_WINDOW)
+        return _latencies[backend]
+
+
+def is_retryable(error):
+    """Connection errors, timeouts and the configured status codes are worth retrying."""
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in settings.UPSTREAM_RETRY_STATUSES
+    return False
+
+
+def backoff_delay(attempt, error=None):
+    """
+    Full-jitter exponential backoff. A Retry-After header from the upstream
+    is honoured when it asks for a longer wait.
+    """
+    delay = random.uniform(0, min(settings.UPSTREAM_BACKOFF_MAX, settings.UPSTREAM_BACKOFF_BASE * (2 ** attempt)))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after", 0))
+        except (TypeError, ValueError):
+            retry_after = 0
+        delay = max(delay, min(retry_after, settings.UPSTREAM_BACKOFF_MAX))
+    return delay
+
+
+def hedge_delay(backend):
+    """Seconds to wait before sending a duplicate request, or None when hedging is off."""
+    if backend not in settings.UPSTREAM_HEDGE_BACKENDS:
+        return None
+    p95 = latency_tracker(backend).percentile(settings.UPSTREAM_HEDGE_PERCENTILE)
+    if p95 is None:
+        return settings.UPSTREAM_HEDGE_DEFAULT_DELAY
+    return p95
+
+
+def _timed(backend, fn, timeout):
+    start = time.monotonic()
+    result = fn(timeout)
+    latency_tracker(backend).record(time.monotonic() - start)
+    return result
+
+
+def _hedged(backend, fn, delay, timeout):
+    """
+    Run fn on a thread of its own and, if it has not answered after delay
+    seconds, a duplicate on the hedge pool. The first successful result is
+    returned; an error is raised only once both calls failed. Whichever call
+    is still running finishes in the background, bounded by its own
+    timeout, and a duplicate still queued for a pool thread is cancelled.
+    """
+    deadline = time.monotonic() + timeout
+    primary = Future()
+
+    def run_primary():
+        primary.set_running_or_notify_cancel()
+        try:
+            primary.set_result(_timed(backend, fn, timeout))
+        except Exception as e:
+            primary.set_exception(e)
+
+    threading.Thread(target=run_primary, name=f"upstream-{backend}", daemon=True).start()
+    pending = {primary}
+    if not wait(pending, timeout=delay).done:
+        left = remaining(deadline)
+        if left > 0:
+            logger.info(f"Hedging {backend} request after {delay:.2f}s")
+            pending.add(_executor.submit(_timed, backend, fn, left))
+
+    error = None
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(0, remaining(deadline)), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+            # Only a duplicate that never got a pool thread is left
+            if all(future.cancel() for future in pending):
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+    if error is not None:
+        raise error
+    import openai
+    raise openai.APITimeoutError(request=None)
+
+
+def call(backend, fn, request_deadline=None):
+    """
+    Call fn(timeout) under the upstream policy: retry retryable failures with
+    jittered exponential backoff until UPSTREAM_MAX_RETRIES or the overall
+    UPSTREAM_DEADLINE is reached, hedging slow calls where enabled.
+
+    fn receives the seconds left for that attempt and must pass them on as
+    the HTTP timeout. When the request deadline runs out first,
+    DeadlineExceeded is raised instead of UpstreamError.
+    """
+    deadline = time.monotonic() + settings.UPSTREAM_DEADLINE
+    if request_deadline is not None:
+        deadline = min(deadline, request_deadline)
+    attempt = 0
+    while True:
+        timeout = remaining(deadline)
+        if timeout <= 0:
+            check(request_deadline)
+            raise UpstreamError("Upstream deadline exceeded")
+        try:
+            delay = hedge_delay(backend)
+            if delay is None:
+                return _timed(backend, fn, timeout)
+            return _hedged(backend, fn, delay, timeout)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            check(request_deadline)
+            status_code = getattr(e, "status_code", None)
+            sleep = backoff_delay(attempt, e)
+            if attempt >= settings.UPSTREAM_MAX_RETRIES or time.monotonic() + sleep >= deadline:
+                logger.warning(f"Upstream {backend} call failed after {attempt + 1} attempts: {e}")
+                raise UpstreamError(str(e), status_code) from e
+            logger.info(f"Retrying upstream {backend} call in {sleep:.2f}s after: {e}")
+            time.sleep(sleep)
+            attempt += 1
@@ -1,9 +1,15 @@
 from django.urls import path
-from .views import AIView, HistoryView
+from .views import (AIView, HistorySearchView, HistoryView, MetricsView, ProfileDetailView,
+                    ProfileListView, UsageView)
 
 
 urlpatterns = [
     path('ai/generate/', AIView.as_view(), name='ai_view'),
     path('ai/info/', AIView.as_view(), name='ai_info'),
     path('history/', HistoryView.as_view(), name='history_view'),
+    path('history/search/', HistorySearchView.as_view(), name='history_search'),
+    path('usage/', UsageView.as_view(), name='usage_view'),
+    path('metrics/', MetricsView.as_view(), name='metrics_view'),
+    path('profiles/', ProfileListView.as_view(), name='profile_list'),
+    path('profiles/<str:profile_id>/', ProfileDetailView.as_view(), name='profile_detail'),
 ]
\ No newline at end of file
@@ -0,0 +1,163 @@
+import atexit
+import threading
+import time
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import UsageCounter
+import logging
+logger = logging.getLogger(__name__)
+
+
+def period_starts(now=None):
+    """(hour start, day start) of the periods now falls into."""
+    now = now or timezone.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    return hour, hour.replace(hour=0)
+
+
+class UsageAccumulator:
+    """
+    Collects usage in memory and writes it to UsageCounter in batches, as
+    F() increments so several worker processes can flush to the same rows.
+    Flushing happens from a background thread every USAGE_FLUSH_INTERVAL
+    seconds, or as soon as USAGE_FLUSH_SIZE records are pending.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.records = 0
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    def record(self, alias, key_id, prompt_tokens=0, completion_tokens=0, requests=1):
+        hour, day = period_starts()
+        with self.lock:
+            for period, start in ((UsageCounter.HOUR, hour), (UsageCounter.DAY, day)):
+                counts = self.pending.setdefault((alias, key_id, period, start), [0, 0, 0])
+                counts[0] += requests
+                counts[1] += prompt_tokens or 0
+                counts[2] += completion_tokens or 0
+            self.records += 1
+            full = self.records >= settings.USAGE_FLUSH_SIZE
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def pending_for(self, alias, key_id, period, start):
+        """Unflushed (requests, prompt_tokens, completion_tokens) of this process."""
+        with self.lock:
+            return tuple(self.pending.get((alias, key_id, period, start), (0, 0, 0)))
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(settings.USAGE_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush usage counters")
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending, self.records = self.pending, {}, 0
+        if not batch:
+            return
+        failed = {}
+        for (alias, key_id, period, start), (requests, prompt_tokens, completion_tokens) in batch.items():
+            try:
+                self._write(alias, key_id, period, start, requests, prompt_tokens, completion_tokens)
+            except Exception:
+                failed[(alias, key_id, period, start)] = [requests, prompt_tokens, completion_tokens]
+        # Cached daily totals no longer include what was just moved out of pending
+        with _daily_cache_lock:
+            _daily_cache.clear()
+        if failed:
+            # Put failed increments back so the next flush retries them
+            with self.lock:
+                for entry, counts in failed.items():
+                    pending = self.pending.setdefault(entry, [0, 0, 0])
+                    for i, value in enumerate(counts):
+                        pending[i] += value
+            raise RuntimeError(f"{len(failed)} usage counters could not be written")
+
+    def _write(self, alias, key_id, period, start, requests, prompt_tokens, completion_tokens):
+        counters = UsageCounter.objects.using(alias).filter(key_id=key_id, period=period, period_start=start)
+        increments = {
+            "requests": F("requests") + requests,
+            "prompt_tokens": F("prompt_tokens") + prompt_tokens,
+            "completion_tokens": F("completion_tokens") + completion_tokens,
+        }
+        if counters.update(**increments):
+            return
+        try:
+            with transaction.atomic(using=alias):
+                UsageCounter.objects.using(alias).create(
+                    key_id=key_id, period=period, period_start=start, requests=requests,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                )
+        except IntegrityError:
+            # Another process created the row first
+            counters.update(**increments)
+
+
+accumulator = UsageAccumulator()
+atexit.register(accumulator.flush)
+
+
+def record(alias, key_id, completion, requests=1):
+    """
+    Count a completion's tokens for a key. requests=0 adds tokens spent on
+    the way to an answer, e.g. a rejected cascade tier, without counting
+    another request.
+    """
+    accumulator.record(alias, key_id, completion.prompt_tokens, completion.completion_tokens, requests)
+
+
+# Flushed daily totals read for quota checks, cached for USAGE_QUOTA_CACHE_TTL
+_daily_cache = {}
+_daily_cache_lock = threading.Lock()
+
+
+def daily_usage(alias, key_id):
+    """
+    Today's (requests, tokens) for a key: the flushed counter row plus what
+    this process has not flushed yet.
+    """
+    _, day = period_starts()
+    cache_key = (alias, key_id, day)
+    now = time.monotonic()
+    with _daily_cache_lock:
+        cached = _daily_cache.get(cache_key)
+    if cached is None or now - cached[0] > settings.USAGE_QUOTA_CACHE_TTL:
+        row = (UsageCounter.objects.using(alias)
+               .filter(key_id=key_id, period=UsageCounter.DAY, period_start=day)
+               .values_list("requests", "prompt_tokens", "completion_tokens")
+               .first()) or (0, 0, 0)
+        cached = (now, row)
+        with _daily_cache_lock:
+            _daily_cache[cache_key] = cached
+    requests, prompt_tokens, completion_tokens = cached[1]
+    pending = accumulator.pending_for(alias, key_id, UsageCounter.DAY, day)
+    return requests + pending[0], prompt_tokens + completion_tokens + pending[1] + pending[2]
+
+
+def quota_status(alias, key):
+    """
+    'ok', 'soft' or 'hard' for the key's daily quotas, with today's usage.
+    """
+    requests, tokens = daily_usage(alias, key.id)
+    state = "ok"
+    for used, limit in ((requests, key.daily_request_quota), (tokens, key.daily_token_quota)):
+        if limit is None:
+            continue
+        if used >= limit:
+            return "hard", requests, tokens
+        if used >= limit * settings.USAGE_SOFT_QUOTA_RATIO:
+            state = "soft"
+    return state, requests, tokens
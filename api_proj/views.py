@@ -1,130 +1,43 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import History
+from .models import History, UsageCounter
 from django.conf import settings
-from openai import OpenAI
-
-messages = [
-    {"role": "system", "content": "You are an expert answer evaluator. Your job is to evaluate student answers fairly based on a flexible rubric and the specified difficulty level.\n\nInstructions:\n1. Return the score out of the total marks.\n2. Give a brief explanation justifying the score, referencing key points from the rubric.\n3. Suggest at least one specific way the student can improve their answer quality or overall academic performance.\n4. Use the rubric as a guideline, not a rigid checklist.\n5. Adjust the strictness of grading based on difficulty:\n   - 'easy' → lenient evaluation; minor issues can be overlooked.\n   - 'medium' → balanced and reasonable evaluation.\n   - 'hard' → stricter evaluation; all points must be well explained and accurate."},
-]
-
-base = f"{settings.VLLM_URL}/v1"
-
-alpaca_prompt = """Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
-
-            ### Instruction:
-            {}
-
-            ### Input:
-            {}
-
-            ### Response:
-            {}"""
+from django.http import FileResponse
+from . import archive, cascade, grading, metrics, output_length, profiling, replicas, scheduler, search, usage
+from .upstream import UpstreamError
+from .deadline import DeadlineExceeded
 
 class AIView(APIView):
     def post(self, request):
         if request.is_authenticated == False:
             return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
-            
-        if request.subdomain == "openai":
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
-            data = request.data
-            prompt = data.get('prompt')
-            model = f"{settings.OPENAI_MODEL_ID}"
-
-            if not prompt:
-                return Response({"error": "Prompt is required"}, status=status.HTTP_400_BAD_REQUEST)
-                
-            # Create a copy of messages to avoid modifying the global list
-            conversation_messages = messages.copy()
-            conversation_messages.append({"role": "user", "content": prompt})
-                
-            try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=conversation_messages  # Use the copy
-                )
 
-                # Save the history
-                history = History(
-                    key=request.key,
-                    input=prompt,
-                    output=response.choices[0].message.content
-                )
-                history.save(using=f"{request.subdomain}")  
+        if request.subdomain not in ("openai", "soc", "sci"):
+            return Response({"error": "Invalid subdomain"}, status=status.HTTP_400_BAD_REQUEST)
 
-                return Response({"response": response.choices[0].message.content}, status=status.HTTP_200_OK)
-            except Exception as e:
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                    
-        elif request.subdomain == "soc":
-                client = OpenAI(
-                    api_key="EMPTY",
-                    base_url=base,
-                )
-                prompt = request.data.get('prompt', '')  # Fixed: get prompt from request data
-                
-                try:
-                    prompts = alpaca_prompt.format(
-                        messages[0]['content'],
-                        prompt,  # Use the extracted prompt
-                        ""
-                    )
-                    
-                    completion = client.completions.create(
-                        model="soc",
-                        prompt=prompts, 
-                        temperature=0.7, 
-                        top_p=0.9, 
-                        max_tokens=500
-                    )
-                    
-                    history = History(
-                        key=request.key,
-                        input=prompt,
-                        output=completion.choices[0].text
-                    )
-                    history.save(using=f"{request.subdomain}")  
+        prompt = request.data.get('prompt', '')
+        if request.subdomain == "openai" and not prompt:
+            return Response({"error": "Prompt is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-                    return Response({"response": completion.choices[0].text.strip()}, status=status.HTTP_200_OK)
-                except Exception as e:  # Fixed: except syntax
-                    return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                    
-        elif request.subdomain == "sci":
-                client = OpenAI(
-                    api_key="EMPTY",
-                    base_url=base,
-                )
-                prompt = request.data.get('prompt', '')  # Fixed: get prompt from request data
-                
-                try:
-                    prompts = alpaca_prompt.format(
-                        messages[0]['content'],
-                        prompt,  # Use the extracted prompt
-                        ""
-                    )
-                    
-                    completion = client.completions.create(
-                        model="sci",
-                        prompt=prompts, 
-                        temperature=0.7, 
-                        top_p=0.9, 
-                        max_tokens=500
-                    )
-                    
-                    history = History(
-                        key=request.key,
-                        input=prompt,
-                        output=completion.choices[0].text
-                    )
-                    history.save(using=f"{request.subdomain}")  
+        # Batch clients send X-Request-Lane: bulk so interactive requests go first
+        lane = request.headers.get('X-Request-Lane', scheduler.INTERACTIVE)
+        if lane not in scheduler.LANES:
+            return Response({"error": f"X-Request-Lane must be one of {', '.join(scheduler.LANES)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-                    return Response({"response": completion.choices[0].text.strip()}, status=status.HTTP_200_OK)
-                except Exception as e:  # Fixed: except syntax
-                    return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        else:
-                return Response({"error": "Invalid subdomain"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            completion = grading.grade(request.subdomain, request.key, prompt, deadline=request.deadline, lane=lane)
+            response = Response({"response": completion.text.strip(), "evaluation": completion.evaluation}, status=status.HTTP_200_OK)
+            # Which model answered, it differs from the subdomain when a cascade tier did
+            if completion.backend:
+                response['X-Served-By'] = completion.backend
+            return response
+        except DeadlineExceeded:
+            return Response({"error": "Request deadline exceeded"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except UpstreamError as e:
+            return Response({"error": f"Upstream model unavailable: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def get(self,request):
         if request.is_authenticated == False:
@@ -288,9 +201,195 @@ class HistoryView(APIView):
         if request.is_authenticated == False:
             return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
         
+        # Optional paging with ?limit=&offset=, the total is sent in X-Total-Count
+        try:
+            limit = request.query_params.get('limit')
+            limit = min(max(int(limit), 1), 1000) if limit is not None else None
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({"error": "limit and offset must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            histories = History.objects.using(f"{request.subdomain}").filter(key=request.key)
-            history_data = [{"id": h.id, "input": h.input, "output": h.output} for h in histories]
-            return Response(history_data, status=status.HTTP_200_OK)
+            page_archived, archived_total = [], 0
+            # Archived rows are only read from the archive segments on request
+            if request.query_params.get('include_archived', '').lower() in ('1', 'true'):
+                if limit is None:
+                    page_archived = archive.read_archived(request.subdomain, request.key.id)
+                    archived_total = len(page_archived)
+                else:
+                    page_archived, archived_total = archive.read_archived_page(
+                        request.subdomain, request.key.id, offset, limit)
+            histories = History.objects.filter(key=request.key).order_by('id')
+            if limit is None:
+                page = histories
+            else:
+                # Archived rows come first, the page continues into the database
+                start = max(0, offset - archived_total)
+                page = histories[start:start + limit - len(page_archived)]
+            history_data = [
+                {
+                    "id": h["id"],
+                    "input": h["input"],
+                    "output": h["output"],
+                    "evaluation": {"Score": h["score"], "Explanation": h["explanation"], "Feedback": h["feedback"]}
+                    if h.get("score") is not None else None,
+                }
+                for h in page_archived
+            ] + [{"id": h.id, "input": h.input, "output": h.output, "evaluation": h.evaluation()} for h in page]
+            response = Response(history_data, status=status.HTTP_200_OK)
+            if limit is not None:
+                response["X-Total-Count"] = archived_total + histories.count()
+            return response
+        except DeadlineExceeded:
+            return Response({"error": "Request deadline exceeded"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class HistorySearchView(APIView):
+    def get(self, request):
+        if request.is_authenticated == False:
+            return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+        if not search.available(request.subdomain):
+            return Response({"error": "Search is not available on this database"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        field = request.query_params.get('field')
+        if field is not None and field not in search.FIELDS:
+            return Response({"error": "field must be 'input' or 'output'"}, status=status.HTTP_400_BAD_REQUEST)
+        query = search.match_query(request.query_params.get('q', ''), field)
+        if query is None:
+            return Response({"error": "q must contain at least one word"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({"error": "limit and offset must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Best matches first, the total is sent in X-Total-Count
+            ids, total = search.search(request.subdomain, request.key.id, query, limit, offset)
+            histories = History.objects.in_bulk(ids)
+            history_data = [
+                {"id": h.id, "input": h.input, "output": h.output, "evaluation": h.evaluation()}
+                for h in (histories[pk] for pk in ids if pk in histories)
+            ]
+            response = Response(history_data, status=status.HTTP_200_OK)
+            response["X-Total-Count"] = total
+            return response
+        except DeadlineExceeded:
+            return Response({"error": "Request deadline exceeded"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class UsageView(APIView):
+    def get(self, request):
+        if request.is_authenticated == False:
+            return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        period = request.query_params.get('period', UsageCounter.DAY)
+        if period not in (UsageCounter.HOUR, UsageCounter.DAY):
+            return Response({"error": "period must be 'hour' or 'day'"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 30)), 1), 1000)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            counters = (UsageCounter.objects.filter(key=request.key, period=period)
+                        .order_by('-period_start')[:limit])
+            state, requests_used, tokens_used = usage.quota_status(request.subdomain, request.key)
+            data = {
+                "period": period,
+                "usage": [
+                    {
+                        "period_start": c.period_start,
+                        "requests": c.requests,
+                        "prompt_tokens": c.prompt_tokens,
+                        "completion_tokens": c.completion_tokens,
+                    }
+                    for c in counters
+                ],
+                "today": {"requests": requests_used, "tokens": tokens_used},
+                "quota": {
+                    "status": state,
+                    "daily_requests": request.key.daily_request_quota,
+                    "daily_tokens": request.key.daily_token_quota,
+                },
+            }
+            return Response(data, status=status.HTTP_200_OK)
+        except DeadlineExceeded:
+            return Response({"error": "Request deadline exceeded"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        if request.is_authenticated == False:
+            return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        counters = metrics.snapshot()
+        leaders = counters.get("coalesce.leaders", 0)
+        followers = counters.get("coalesce.followers", 0)
+        hits = counters.get("near_duplicate.hits", 0)
+        misses = counters.get("near_duplicate.misses", 0)
+        data = {
+            "counters": counters,
+            "coalesce_rate": metrics.ratio(followers, leaders + followers),
+            "near_duplicate_hit_rate": metrics.ratio(hits, hits + misses),
+            "scheduler_waiting": scheduler.waiting(),
+            "vllm_replicas": replicas.status(),
+            "max_tokens": output_length.current_limits(),
+            "cascade": cascade.report(counters),
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ProfileListView(APIView):
+    def get(self, request):
+        if request.is_authenticated == False:
+            return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+        if not profiling.authorized(request):
+            return Response({"error": f"{profiling.PROFILE_HEADER} token required"}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), settings.PROFILE_MAX_FILES)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"profiles": profiling.list_profiles()[:limit]}, status=status.HTTP_200_OK)
+
+
+class ProfileDetailView(APIView):
+    SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+    def get(self, request, profile_id):
+        if request.is_authenticated == False:
+            return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+        if not profiling.authorized(request):
+            return Response({"error": f"{profiling.PROFILE_HEADER} token required"}, status=status.HTTP_403_FORBIDDEN)
+
+        info = profiling.load(profile_id)
+        if info is None:
+            return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        # The raw trace, for pstats or snakeviz
+        if request.query_params.get('download'):
+            try:
+                trace = open(profiling.path(profile_id, "prof"), "rb")
+            except FileNotFoundError:
+                # Rotated out between reading the description and the trace
+                return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+            return FileResponse(trace, as_attachment=True, filename=f"{profile_id}.prof")
+
+        sort = request.query_params.get('sort', 'cumulative')
+        if sort not in self.SORT_KEYS:
+            return Response({"error": f"sort must be one of {', '.join(self.SORT_KEYS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 40)), 1), 500)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stats = profiling.report(profile_id, sort, limit)
+        except FileNotFoundError:
+            return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({**info, "stats": stats}, status=status.HTTP_200_OK)
@@ -0,0 +1,86 @@
+"""
+Production server settings: `gunicorn -c gunicorn.conf.py`
+
+The API mixes long, I/O-bound LLM calls (seconds) with cheap GETs, so
+workers are sized for concurrent upstream calls rather than CPU alone:
+
+- SERVER_MODE=wsgi (default): gthread workers. Each blocked upstream call
+  holds one thread, so WORKERS * THREADS is the number of generations in
+  flight per host.
+- SERVER_MODE=asgi: uvicorn workers (`pip install uvicorn`). Requests are
+  accepted by an event loop and Django runs each request's sync code on a
+  thread of its own (a per-request ThreadSensitiveContext), so no thread
+  pool limits concurrency and THREADS does not apply. Upstream calls are
+  bounded by UPSTREAM_SLOTS instead.
+
+Reload gracefully with `kill -HUP <master pid>`: new workers start before
+old ones finish their in-flight requests.
+"""
+import math
+import multiprocessing
+import os
+import subprocess
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi")
+CPUS = multiprocessing.cpu_count()
+# Generations expected in flight at once across the host
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "64"))
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+# One process per core for the CPU-bound parts (JSON, hashing, ORM); more
+# would only add memory since the waiting happens in threads.
+workers = int(os.getenv("WORKERS", max(2, CPUS)))
+threads = int(os.getenv("THREADS", max(4, math.ceil(UPSTREAM_CONCURRENCY / workers))))
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "AI_api.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "AI_api.wsgi:application"
+    worker_class = "gthread"
+
+# Keep idle client connections longer than typical load balancer idle
+# timeouts (60s) so the proxy never reuses a socket gunicorn just closed.
+keepalive = int(os.getenv("KEEPALIVE", "75"))
+# Workers are only killed once a request has outlived the server's own
+# deadline (REQUEST_TIMEOUT_MAX), which answers with a 504 first.
+timeout = int(float(os.getenv("REQUEST_TIMEOUT_MAX", "120"))) + 30
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Recycle workers now and then, jittered so they do not restart together
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+# Import the app in each worker, after the fork, so upstream clients,
+# background threads and database connections are never shared.
+preload_app = False
+backlog = int(os.getenv("BACKLOG", "2048"))
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+errorlog = "-"
+
+_shared_state = None
+
+
+def on_starting(server):
+    """Start the shared state daemon next to the workers when a socket is configured."""
+    global _shared_state
+    if os.getenv("SHARED_STATE_SOCKET") and os.getenv("START_SHARED_STATE", "true").lower() == "true":
+        manage = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manage.py")
+        _shared_state = subprocess.Popen([sys.executable, manage, "shared_state"])
+        server.log.info(f"Started shared state daemon (pid {_shared_state.pid})")
+
+
+def post_worker_init(worker):
+    """Connect to the vLLM replicas before the worker takes requests."""
+    from api_proj import replicas
+    replicas.start()
+
+
+def on_exit(server):
+    if _shared_state is not None:
+        _shared_state.terminate()
+        _shared_state.wait(timeout=10)
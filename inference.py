@@ -1,9 +1,15 @@
 import streamlit as st
 import requests
 import hashlib
+import io
 import json
+import os
+import tempfile
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from api_proj import bulk
 
 # Configure Streamlit page
 st.set_page_config(
@@ -15,6 +21,16 @@ st.set_page_config(
 
 
 BASE_URL = "http://localhost:8000"
+# Seconds to wait for the API. Sent as X-Request-Timeout so the server gives up at the same time.
+REQUEST_TIMEOUT = 60
+# Evaluations submitted at once in batch mode, also the size of the connection pool
+BATCH_CONCURRENCY = 8
+# Seconds model info and history pages are reused across reruns before refetching
+MODEL_INFO_TTL = 300
+HISTORY_TTL = 30
+HISTORY_PAGE_SIZE = 50
+# Results of uploaded files, named after the file contents so uploading it again resumes
+UPLOAD_RESULTS_DIR = os.path.join(tempfile.gettempdir(), "ai_api_uploads")
 # Model configurations
 MODELS = {
     "OpenAI GPT-4.1 Mini": {
@@ -46,17 +62,60 @@ host_mapping = {
         "op.soc": "op.soc.localhost", 
         "op.sci": "op.sci.localhost"
     }
+@st.cache_resource
+def get_session():
+    """One pooled session shared by all reruns, so connections to the API are kept alive."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=BATCH_CONCURRENCY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=MODEL_INFO_TTL, show_spinner=False)
+def fetch_model_info(domain, api_key):
+    return APIClient(domain, api_key).request("GET", "/ai/info/").json()
+
+
+@st.cache_data(ttl=HISTORY_TTL, show_spinner=False)
+def fetch_history(domain, api_key, page, query=""):
+    params = {"limit": HISTORY_PAGE_SIZE, "offset": (page - 1) * HISTORY_PAGE_SIZE}
+    path = "/history/"
+    if query:
+        # Ranked full-text search on the server
+        params["q"] = query
+        path = "/history/search/"
+    response = APIClient(domain, api_key).request("GET", path, params=params)
+    return {"records": response.json(), "total": int(response.headers.get("X-Total-Count", 0))}
+
+
+def uploaded_rows(uploaded, fmt):
+    """Stream rows from an uploaded file without decoding it all at once."""
+    uploaded.seek(0)
+    handle = io.TextIOWrapper(uploaded, encoding="utf-8", newline="")
+    try:
+        yield from bulk.read_rows(handle, fmt)
+    finally:
+        handle.detach()
+
+
+class APIError(Exception):
+    pass
+
+
 class APIClient:
     def __init__(self, domain, api_key):
         self.domain = domain
         self.api_key = api_key
         self.host = host_mapping[domain]
+        self.session = get_session()
     
     def get_headers(self, data=None):
         headers = {
             'X-API-KEY': self.api_key,
             'Content-Type': 'application/json',
-            'Host': self.host
+            'Host': self.host,
+            'X-Request-Timeout': str(REQUEST_TIMEOUT)
         }
         
         if data is not None:
@@ -66,48 +125,58 @@ class APIClient:
             return headers, json_string
             
         return headers, None
+
+    def request(self, method, path, data=None, params=None, extra_headers=None):
+        """Send a request over the pooled session, raising APIError unless it returns 200."""
+        headers, body = self.get_headers(data)
+        headers.update(extra_headers or {})
+        response = self.session.request(
+            method,
+            f"{BASE_URL}{path}",
+            data=body,
+            headers=headers,
+            params=params,
+            timeout=REQUEST_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise APIError(f"Error {response.status_code}: {response.text}")
+        return response
     
     def get_model_info(self):
-        """Get AI model information"""
+        """Get AI model information, cached for MODEL_INFO_TTL seconds"""
         try:
-            headers, _ = self.get_headers()
-            response = requests.get(f"{BASE_URL}/ai/info", headers=headers)
-            if response.status_code == 200:
-                return response.json(), None
-            else:
-                return None, f"Error {response.status_code}: {response.text}"
+            return fetch_model_info(self.domain, self.api_key), None
         except Exception as e:
             return None, str(e)
     
-    def generate_response(self, prompt):
-        """Generate AI response"""
+    def generate_response(self, prompt, lane="interactive"):
+        """Generate AI response; batches use the "bulk" lane so they queue behind interactive requests"""
         try:
-            data = {"prompt": prompt}
-            headers, json_data = self.get_headers(data)
-            
-            response = requests.post(
-                f"{BASE_URL}/ai/generate/", 
-                data=json_data,
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                return response.json(), None
-            else:
-                return None, f"Error {response.status_code}: {response.text}"
+            response = self.request("POST", "/ai/generate/", data={"prompt": prompt},
+                                    extra_headers={'X-Request-Lane': lane})
+            return response.json(), None
         except Exception as e:
             return None, str(e)
 
-    def get_history(self):
-        """Get user's history"""
+    def generate_batch(self, prompts, concurrency=BATCH_CONCURRENCY):
+        """
+        Submit prompts concurrently and yield (index, result, error) as each
+        one finishes, so the caller can show progress.
+        """
+        executor = ThreadPoolExecutor(max_workers=concurrency)
         try:
-            headers, _ = self.get_headers()
-            response = requests.get(f"{BASE_URL}/history/", headers=headers)
+            futures = {executor.submit(self.generate_response, prompt, "bulk"): index for index, prompt in enumerate(prompts)}
+            for future in as_completed(futures):
+                result, error = future.result()
+                yield futures[future], result, error
+        finally:
+            # A Streamlit rerun stops the script mid-batch, drop what has not started
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            if response.status_code == 200:
-                return response.json(), None
-            else:
-                return None, f"Error {response.status_code}: {response.text}"
+    def get_history(self, page=1, query=""):
+        """Get one page of the user's history, or of search results, cached for HISTORY_TTL seconds"""
+        try:
+            return fetch_history(self.domain, self.api_key, page, query), None
         except Exception as e:
             return None, str(e)
 
@@ -137,7 +206,7 @@ def main():
     client = APIClient(domain, api_key)
     
     # Main content tabs
-    tab1, tab2, tab3 = st.tabs(["💬 Generate Response", "📊 Model Information", "📜 History"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["💬 Generate Response", "📊 Model Information", "📜 History", "📦 Batch", "📤 Upload"])
     
     with tab1:
         st.header("Generate AI Response")
@@ -201,6 +270,8 @@ def main():
                         st.error(f"❌ Error: {error}")
                     else:
                         st.success("✅ Response generated successfully!")
+                        # The new evaluation shows up in the history
+                        fetch_history.clear()
                         
                         # Display the input data in a structured format
                         st.markdown("#### 📋 Evaluation Input:")
@@ -223,8 +294,10 @@ def main():
                         
                         # Try to parse and display structured AI response
                         try:
-                            # Try to parse as JSON first
-                            response_data = json.loads(response_text)
+                            # The API returns the parsed evaluation, fall back to parsing the raw text
+                            response_data = result.get("evaluation") if isinstance(result, dict) else None
+                            if response_data is None:
+                                response_data = json.loads(response_text)
                             
                             col3, col4 = st.columns(2)
                             with col3:
@@ -252,62 +325,69 @@ def main():
         st.header("📊 Model Information")
         
         if st.button("🔄 Refresh Model Info", type="secondary"):
-            with st.spinner("Fetching model information..."):
-                info, error = client.get_model_info()
+            fetch_model_info.clear()
+        
+        with st.spinner("Fetching model information..."):
+            info, error = client.get_model_info()
+            
+            if error:
+                st.error(f"❌ Error fetching model info: {error}")
+            else:
+                st.success("✅ Model information retrieved!")
                 
-                if error:
-                    st.error(f"❌ Error fetching model info: {error}")
-                else:
-                    st.success("✅ Model information retrieved!")
-                    
-                    # Display model info in a nice format
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("#### 🏷️ Basic Information")
-                        if isinstance(info, dict):
-                            st.markdown(f"**Model Name:** {info.get('model_name', 'N/A')}")
-                            st.markdown(f"**Version:** {info.get('version', 'N/A')}")
-                            st.markdown(f"**Last Updated:** {info.get('last_updated', 'N/A')}")
-                            st.markdown(f"**Accuracy:** {info.get('accuracy', 'N/A')}")
-                        
-                        st.markdown("#### 💰 Pricing")
-                        if isinstance(info, dict) and 'pricing' in info:
-                            pricing = info['pricing']
-                            st.markdown(f"**Per Request:** {pricing.get('per_request', 'N/A')}")
-                            st.markdown(f"**Bulk Discount:** {pricing.get('bulk_discount', 'N/A')}")
+                # Display model info in a nice format
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.markdown("#### 🏷️ Basic Information")
+                    if isinstance(info, dict):
+                        st.markdown(f"**Model Name:** {info.get('model_name', 'N/A')}")
+                        st.markdown(f"**Version:** {info.get('version', 'N/A')}")
+                        st.markdown(f"**Last Updated:** {info.get('last_updated', 'N/A')}")
+                        st.markdown(f"**Accuracy:** {info.get('accuracy', 'N/A')}")
                     
-                    with col2:
-                        st.markdown("#### ⚡ Technical Specs")
-                        if isinstance(info, dict) and 'limitations' in info:
-                            limits = info['limitations']
-                            st.markdown(f"**Max Tokens:** {limits.get('max_tokens', 'N/A')}")
-                            st.markdown(f"**Context Window:** {limits.get('context_window', 'N/A')}")
-                            st.markdown(f"**Rate Limits:** {limits.get('rate_limits', 'N/A')}")
-                        
-                        st.markdown("#### 🎯 Capabilities")
-                        if isinstance(info, dict) and 'capabilities' in info:
-                            for capability in info['capabilities']:
-                                st.markdown(f"• {capability}")
+                    st.markdown("#### 💰 Pricing")
+                    if isinstance(info, dict) and 'pricing' in info:
+                        pricing = info['pricing']
+                        st.markdown(f"**Per Request:** {pricing.get('per_request', 'N/A')}")
+                        st.markdown(f"**Bulk Discount:** {pricing.get('bulk_discount', 'N/A')}")
+                
+                with col2:
+                    st.markdown("#### ⚡ Technical Specs")
+                    if isinstance(info, dict) and 'limitations' in info:
+                        limits = info['limitations']
+                        st.markdown(f"**Max Tokens:** {limits.get('max_tokens', 'N/A')}")
+                        st.markdown(f"**Context Window:** {limits.get('context_window', 'N/A')}")
+                        st.markdown(f"**Rate Limits:** {limits.get('rate_limits', 'N/A')}")
                     
-                    # Show full JSON
-                    with st.expander("🔍 View Full Model Information"):
-                        st.json(info)
-    
+                    st.markdown("#### 🎯 Capabilities")
+                    if isinstance(info, dict) and 'capabilities' in info:
+                        for capability in info['capabilities']:
+                            st.markdown(f"• {capability}")
+                
+                # Show full JSON
+                with st.expander("🔍 View Full Model Information"):
+                    st.json(info)
+
     with tab3:
         st.header("📜 Request History")
         
         if st.button("🔄 Refresh History", type="secondary"):
+            fetch_history.clear()
             st.rerun()
         
+        query = st.text_input("Search:", help="Words from the question, answer, rubrics or evaluation; end a word with * to match prefixes")
+        page = st.number_input("Page:", min_value=1, value=1, step=1)
         with st.spinner("Fetching history..."):
-            history, error = client.get_history()
+            history_page, error = client.get_history(page, query.strip())
             if error:
                 st.error(f"❌ Error fetching history: {error}")
             else:
+                history = history_page["records"]
                 if isinstance(history, list):
                     if history:
-                        st.success(f"✅ Found {len(history)} records")
+                        first = (page - 1) * HISTORY_PAGE_SIZE + 1
+                        st.success(f"✅ Showing records {first}-{first + len(history) - 1} of {history_page['total']}")
 
                         # Convert to DataFrame for better display
                         df_data = []
@@ -361,8 +441,8 @@ def main():
                                         
                                         # Try to parse the AI output as JSON or extract structured information
                                         try:
-                                            # Try to parse as JSON first
-                                            output_data = json.loads(output_text)
+                                            # Use the evaluation parsed by the API, fall back to the raw text
+                                            output_data = selected_record.get('evaluation') or json.loads(output_text)
                                             
                                             col3, col4 = st.columns(2)
                                             with col3:
@@ -388,5 +468,102 @@ def main():
                             else:
                                 st.warning("⚠️ Unexpected response format from history endpoint.")
 
+    with tab4:
+        st.header("📦 Batch Evaluation")
+        st.markdown(
+            "One evaluation per line, as JSON with `question`, `answer`, `rubrics`, "
+            f"`total_marks` and `difficulty`. Up to {BATCH_CONCURRENCY} are sent at once."
+        )
+
+        with st.form("batch_form"):
+            batch_text = st.text_area("Evaluations (JSON Lines):", height=200)
+            batch_submitted = st.form_submit_button("🚀 Evaluate Batch", type="primary")
+
+        if batch_submitted:
+            prompts, invalid = [], []
+            for line_number, line in enumerate(batch_text.splitlines(), 1):
+                if not line.strip():
+                    continue
+                try:
+                    prompts.append((line_number, json.dumps(json.loads(line))))
+                except json.JSONDecodeError:
+                    invalid.append(line_number)
+            if invalid:
+                st.warning(f"⚠️ Skipped lines that are not valid JSON: {', '.join(map(str, invalid))}")
+
+            if prompts:
+                progress = st.progress(0.0, text=f"0/{len(prompts)} evaluated")
+                rows = [None] * len(prompts)
+                failed = 0
+                for done, (index, result, error) in enumerate(client.generate_batch([p for _, p in prompts]), 1):
+                    evaluation = (result or {}).get("evaluation") or {}
+                    rows[index] = {
+                        "Line": prompts[index][0],
+                        "Score": evaluation.get("Score"),
+                        "Explanation": evaluation.get("Explanation"),
+                        "Feedback": evaluation.get("Feedback"),
+                        "Error": error,
+                    }
+                    failed += error is not None
+                    progress.progress(done / len(prompts), text=f"{done}/{len(prompts)} evaluated")
+                fetch_history.clear()
+
+                if failed:
+                    st.error(f"❌ {failed} of {len(prompts)} evaluations failed")
+                else:
+                    st.success(f"✅ Evaluated {len(prompts)} answers")
+                st.dataframe(pd.DataFrame(rows), use_container_width=True)
+
+    with tab5:
+        st.header("📤 Grade a File")
+        st.markdown(
+            "Upload a CSV or JSON Lines file with `question`, `answer`, `rubrics`, `total_marks` "
+            "and `difficulty` columns; an `id` column is copied to the results. "
+            "Uploading the same file again resumes where grading stopped."
+        )
+
+        uploaded = st.file_uploader("File:", type=["csv", "jsonl"])
+        if uploaded is not None:
+            fmt = bulk.file_format(uploaded.name)
+            digest = hashlib.sha256(uploaded.getvalue() + domain.encode("utf-8")).hexdigest()[:16]
+            os.makedirs(UPLOAD_RESULTS_DIR, exist_ok=True)
+            output = os.path.join(UPLOAD_RESULTS_DIR, f"{digest}.csv")
+
+            if st.button("🚀 Grade File", type="primary"):
+                done = bulk.completed_rows(output)
+                total = sum(1 for _ in uploaded_rows(uploaded, fmt))
+                progress = st.progress(0.0, text=f"0/{total} graded")
+                finished = {"count": len(done)}
+
+                def on_result(result):
+                    finished["count"] += 1
+                    progress.progress(min(finished["count"] / max(total, 1), 1.0),
+                                      text=f"{finished['count']}/{total} graded")
+
+                def submit(prompt):
+                    result, error = client.generate_response(prompt, lane="bulk")
+                    if error:
+                        raise APIError(error)
+                    return result.get("evaluation")
+
+                with bulk.ResultWriter(output) as writer:
+                    counts = bulk.run(
+                        uploaded_rows(uploaded, fmt), submit, writer,
+                        concurrency=BATCH_CONCURRENCY, done=done, on_result=on_result,
+                    )
+                fetch_history.clear()
+                if counts["failed"]:
+                    st.error(f"❌ {counts['failed']} rows failed, grade the file again to retry them")
+                st.success(f"✅ Graded {counts['graded']} rows, {counts['skipped']} were already graded")
+
+            if os.path.exists(output):
+                with open(output, "rb") as results:
+                    st.download_button(
+                        "⬇️ Download Results",
+                        results,
+                        file_name=f"{os.path.splitext(uploaded.name)[0]}.graded.csv",
+                        mime="text/csv"
+                    )
+
 if __name__ == "__main__":
     main()
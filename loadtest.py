@@ -0,0 +1,142 @@
+"""
+Load-test harness for the API.
+
+Runs a fixed mix of /ai/info/, /history/ and /ai/generate/ requests from
+concurrent keep-alive clients for a given duration and prints throughput
+and latency percentiles per endpoint.
+
+    python loadtest.py --host op.soc.localhost --api-key <key> --concurrency 32 --duration 30
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+SAMPLE_PROMPT = {
+    "question": "What are resources? What are its characteristics?",
+    "answer": "Resources are materials in the environment that are useful to humans.",
+    "rubrics": "1 mark for a correct definition. 1 mark for accessibility. 1 mark for cultural acceptability.",
+    "total_marks": 3,
+    "difficulty": "medium",
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        mix[name] = float(weight)
+    return mix
+
+
+class Worker(threading.Thread):
+    def __init__(self, args, stop_at, results, lock):
+        super().__init__(daemon=True)
+        self.args = args
+        self.stop_at = stop_at
+        self.results = results
+        self.lock = lock
+        self.url = urlparse(args.url)
+        self.rng = random.Random()
+        self.connection = None
+
+    def connect(self):
+        self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.args.timeout)
+
+    def request(self, endpoint):
+        headers = {"Host": self.args.host, "X-API-KEY": self.args.api_key}
+        body = None
+        if endpoint == "generate":
+            prompt = dict(SAMPLE_PROMPT)
+            if not self.args.identical:
+                prompt["answer"] += f" ({self.rng.random()})"
+            body = json.dumps({"prompt": json.dumps(prompt)}, separators=(",", ":"))
+            headers["Content-Type"] = "application/json"
+            headers["X-Content-Hash"] = hashlib.sha256(body.encode("utf-8")).hexdigest()
+            headers["X-Request-Lane"] = self.args.lane
+            method, path = "POST", "/ai/generate/"
+        elif endpoint == "history":
+            method, path = "GET", "/history/"
+        else:
+            method, path = "GET", "/ai/info/"
+
+        if self.connection is None:
+            self.connect()
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader("Connection", "").lower() == "close":
+                self.connection.close()
+                self.connection = None
+        except (OSError, http.client.HTTPException):
+            status = 0
+            self.connection.close()
+            self.connection = None
+        return status, time.perf_counter() - start
+
+    def run(self):
+        endpoints = list(self.args.mix)
+        weights = [self.args.mix[name] for name in endpoints]
+        while time.monotonic() < self.stop_at:
+            endpoint = self.rng.choices(endpoints, weights)[0]
+            status, latency = self.request(endpoint)
+            with self.lock:
+                self.results[endpoint].append((status, latency))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--host", default="op.soc.localhost", help="Host header selecting the subdomain.")
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("info=0.6,history=0.1,generate=0.3"),
+                        help="Endpoint weights, e.g. info=0.6,history=0.1,generate=0.3")
+    parser.add_argument("--identical", action="store_true",
+                        help="Send the same prompt every time instead of unique answers.")
+    parser.add_argument("--lane", choices=["interactive", "bulk"], default="interactive",
+                        help="Scheduler lane of generate requests.")
+    args = parser.parse_args()
+
+    results = defaultdict(list)
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+    workers = [Worker(args, stop_at, results, lock) for _ in range(args.concurrency)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    print(f"{args.concurrency} clients, {elapsed:.1f}s")
+    print(f"{'endpoint':<10} {'requests':>9} {'req/s':>8} {'non-2xx':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    total = 0
+    for endpoint, samples in sorted(results.items()):
+        latencies = [latency * 1000 for status, latency in samples]
+        errors = sum(1 for status, _ in samples if not 200 <= status < 300)
+        total += len(samples)
+        print(f"{endpoint:<10} {len(samples):>9} {len(samples) / elapsed:>8.1f} {errors:>7} "
+              f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f}")
+    print(f"{'total':<10} {total:>9} {total / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
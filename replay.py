@@ -0,0 +1,237 @@
+"""
+Replay captured traffic against a server and compare two runs.
+
+Captures come from CaptureMiddleware (CAPTURE_SAMPLE_RATE, see
+api_proj/capture.py). `run` reissues them in their original order and
+spacing, --speed times faster, with each request's Host header and body.
+API keys are not captured, so give one per host, or map the captured key
+fingerprints to keys with --key-map. Results are written as JSONL so two
+builds can be compared:
+
+    python replay.py run captures/ --url http://localhost:8000 --api-key op.soc.localhost=<key> --output before.jsonl
+    python replay.py run captures/ --url http://localhost:8000 --api-key op.soc.localhost=<key> --output after.jsonl
+    python replay.py compare before.jsonl after.jsonl
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from loadtest import percentile
+
+# Set per connection by http.client, not copied from the capture
+SKIPPED_HEADERS = {"content-length", "connection", "keep-alive", "transfer-encoding"}
+
+
+def load_captures(sources, limit=None):
+    """Capture records from files and directories of capture-*.jsonl, oldest first."""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(os.path.join(source, name) for name in sorted(os.listdir(source))
+                         if name.startswith("capture-") and name.endswith(".jsonl"))
+        else:
+            paths.append(source)
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as handle:
+            records.extend(json.loads(line) for line in handle if line.strip())
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def parse_api_keys(values):
+    keys = {}
+    for value in values or []:
+        host, _, key = value.partition("=")
+        keys[host] = key
+    return keys
+
+
+class Replayer(threading.Thread):
+    def __init__(self, args, jobs, results, lock):
+        super().__init__(daemon=True)
+        self.args = args
+        self.jobs = jobs
+        self.results = results
+        self.lock = lock
+        self.url = urlparse(args.url)
+        self.connection = None
+
+    def send(self, record, api_key):
+        headers = {name: value for name, value in record["headers"].items() if name.lower() not in SKIPPED_HEADERS}
+        headers["X-API-KEY"] = api_key
+        body = record["body"].encode("utf-8") if record["body"] else None
+        if body is not None and "X-Content-Hash" in headers:
+            headers["X-Content-Hash"] = hashlib.sha256(body).hexdigest()
+        path = record["path"] + (f"?{record['query']}" if record["query"] else "")
+
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.args.timeout)
+        start = time.perf_counter()
+        try:
+            self.connection.request(record["method"], path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader("Connection", "").lower() == "close":
+                self.connection.close()
+                self.connection = None
+        except (OSError, http.client.HTTPException):
+            status = 0
+            self.connection.close()
+            self.connection = None
+        return status, time.perf_counter() - start
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            record, api_key, due = job
+            lag = time.monotonic() - due
+            status, latency = self.send(record, api_key)
+            with self.lock:
+                self.results.append({
+                    "method": record["method"],
+                    "path": record["path"],
+                    "host": record["headers"].get("Host", ""),
+                    "status": status,
+                    "captured_status": record["status"],
+                    "latency_ms": round(latency * 1000, 1),
+                    "captured_ms": record["duration_ms"],
+                    "lag_ms": round(lag * 1000, 1),
+                })
+
+
+def summarize(results):
+    """Per-path request counts, error counts and latency percentiles."""
+    by_path = defaultdict(list)
+    for result in results:
+        by_path[result["path"]].append(result)
+    summary = {}
+    for path, rows in sorted(by_path.items()):
+        latencies = [row["latency_ms"] for row in rows]
+        summary[path] = {
+            "requests": len(rows),
+            "errors": sum(1 for row in rows if not 200 <= row["status"] < 300),
+            "changed": sum(1 for row in rows if row["status"] != row["captured_status"]),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        }
+    return summary
+
+
+def run(args):
+    records = load_captures(args.sources, args.limit)
+    if not records:
+        raise SystemExit("No captured requests found")
+    host_keys = parse_api_keys(args.api_key)
+    key_map = {}
+    if args.key_map:
+        with open(args.key_map, encoding="utf-8") as handle:
+            key_map = json.load(handle)
+
+    jobs = queue.Queue()
+    results = []
+    lock = threading.Lock()
+    workers = [Replayer(args, jobs, results, lock) for _ in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+
+    skipped = 0
+    first = records[0]["ts"]
+    started = time.monotonic()
+    for record in records:
+        api_key = key_map.get(record.get("key")) or host_keys.get(record["headers"].get("Host", ""))
+        if not api_key:
+            skipped += 1
+            continue
+        # Keep the captured spacing between requests, scaled by --speed
+        due = started + (record["ts"] - first) / args.speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        jobs.put((record, api_key, due))
+    for _ in workers:
+        jobs.put(None)
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.writelines(json.dumps(result) + "\n" for result in results)
+
+    lags = [result["lag_ms"] for result in results]
+    print(f"Replayed {len(results)} of {len(records)} requests in {elapsed:.1f}s at {args.speed}x, "
+          f"{skipped} skipped without an API key, p95 send lag {percentile(lags, 95):.1f} ms")
+    print(f"{'path':<16} {'requests':>9} {'non-2xx':>7} {'changed':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for path, row in summarize(results).items():
+        print(f"{path:<16} {row['requests']:>9} {row['errors']:>7} {row['changed']:>7} "
+              f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f}")
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def compare(args):
+    before = summarize(read_results(args.before))
+    after = summarize(read_results(args.after))
+    print(f"{'path':<16} {'metric':<10} {'before':>9} {'after':>9} {'delta':>9} {'change':>8}")
+    for path in sorted(set(before) | set(after)):
+        a = before.get(path)
+        b = after.get(path)
+        if a is None or b is None:
+            print(f"{path:<16} only in {'after' if a is None else 'before'}")
+            continue
+        rows = [
+            ("error %", 100 * a["errors"] / a["requests"], 100 * b["errors"] / b["requests"]),
+            ("p50 ms", a["p50"], b["p50"]),
+            ("p95 ms", a["p95"], b["p95"]),
+            ("p99 ms", a["p99"], b["p99"]),
+        ]
+        for metric, old, new in rows:
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+            print(f"{path:<16} {metric:<10} {old:>9.1f} {new:>9.1f} {new - old:>+9.1f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Replay captures against a server.")
+    run_parser.add_argument("sources", nargs="+", help="Capture files or directories.")
+    run_parser.add_argument("--url", default="http://localhost:8000")
+    run_parser.add_argument("--api-key", action="append", metavar="HOST=KEY",
+                            help="API key for requests to a Host, can be repeated.")
+    run_parser.add_argument("--key-map", help="JSON file mapping captured key fingerprints to API keys.")
+    run_parser.add_argument("--speed", type=float, default=1.0,
+                            help="Replay rate relative to the captured one, e.g. 2 for twice as fast.")
+    run_parser.add_argument("--concurrency", type=int, default=64, help="Requests in flight at most.")
+    run_parser.add_argument("--timeout", type=float, default=120)
+    run_parser.add_argument("--limit", type=int, help="Replay only the first N requests.")
+    run_parser.add_argument("--output", help="Write per-request results to this JSONL file.")
+
+    compare_parser = commands.add_parser("compare", help="Latency and error deltas between two runs.")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()